@@ -0,0 +1,55 @@
+"""
+    Calculator benchmark
+    Compares /calculate latency of the local evaluator (``bot.calculator``), cold and
+    with its compile cache warm, against the mathjs.org API on an expression corpus.
+
+    Run from the project folder: ``python -m benchmarks.calculator``
+    (add ``--remote`` to also time mathjs.org, it needs network access)
+"""
+import sys
+import time
+
+from bot.calculator import Calculator
+from bot.commands import calculate_remote
+
+CORPUS = (
+    "2+2",
+    "5*5",
+    "2^10",
+    "7/2",
+    "(3+4)*(5-2)/7",
+    "sqrt(16)+3",
+    "sin(pi/2)",
+    "log(e^3)",
+    "10!",
+    "2 inch to cm",
+    "3 kg in lb",
+    "12.5 % 4",
+    "abs(-3.5)*floor(2.7)",
+    "2^64",
+    "cos(0)+tan(0)+exp(0)",
+)
+ROUNDS = 200
+
+
+def time_per_call(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for expr in CORPUS:
+            func(expr)
+    return (time.perf_counter() - start) / (rounds * len(CORPUS))
+
+
+def main():
+    cold = time_per_call(lambda expr: Calculator(cache_size=0).evaluate(expr), ROUNDS)
+    warm_calculator = Calculator()
+    warm = time_per_call(warm_calculator.evaluate, ROUNDS)
+    print(f"local, cold: {cold * 1e6:,.1f} µs/expression")
+    print(f"local, cached: {warm * 1e6:,.1f} µs/expression")
+    if "--remote" in sys.argv:
+        remote = time_per_call(calculate_remote, 1)
+        print(f"mathjs.org: {remote * 1e6:,.1f} µs/expression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+    Memory benchmark of the DB data types
+    Compares the per-object footprint of ``__dict__`` based types (as they were)
+    with the ``__slots__`` types in ``bot.data_types``.
+
+    Run from the project folder: ``python -m benchmarks.data_types_memory``
+"""
+import tracemalloc
+
+from bot.data_types import User, Message
+
+COUNT = 100000
+
+
+class DictUser:
+    """The User type before ``__slots__``"""
+
+    def __init__(self, *fields):
+        (
+            self.id,
+            self.is_bot,
+            self.is_admin,
+            self.first_name,
+            self.last_name,
+            self.username,
+            self.language_code,
+            self.active,
+            self.created,
+            self.updated,
+            self.last_command,
+            self.chat_id,
+        ) = fields
+
+
+class DictMessage:
+    """The Message type before ``__slots__``"""
+
+    def __init__(self, *fields):
+        (
+            self.id,
+            self.update_id,
+            self.user_id,
+            self.chat_id,
+            self.date,
+            self.text,
+        ) = fields
+
+
+def user_row(i):
+    return (
+        i,
+        0,
+        0,
+        "Ahmed",
+        "Shahwan",
+        f"user{i}",
+        "en",
+        1,
+        1555512911,
+        1556303495,
+        None,
+        i,
+    )
+
+
+def message_row(i):
+    return (i, i, i, i, 1555512911, "message text")
+
+
+def bytes_per_object(data_type, make_row) -> float:
+    """Average bytes allocated per object, excluding the shared field values"""
+    rows = [make_row(i) for i in range(COUNT)]
+    tracemalloc.start()
+    objects = [data_type(*row) for row in rows]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / COUNT
+
+
+def main():
+    print(f"per-object footprint, {COUNT} objects")
+    for name, before, after, make_row in (
+        ("User", DictUser, User, user_row),
+        ("Message", DictMessage, Message, message_row),
+    ):
+        old = bytes_per_object(before, make_row)
+        new = bytes_per_object(after, make_row)
+        print(
+            f"{name:8} __dict__: {old:6.0f} B  __slots__: {new:6.0f} B  ({new / old:.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+    Update parsing microbenchmark
+    Measures how many updates per second ``bot.updates.parse_updates`` decodes
+    from a raw getUpdates response body (JSON decoding included).
+
+    Run from the project folder: ``python -m benchmarks.update_parsing``
+"""
+import json
+import time
+
+from bot.updates import loads, parse_updates
+
+BATCH = 100  # getUpdates returns at most 100 updates
+ROUNDS = 500
+
+
+def make_body() -> bytes:
+    updates = [
+        {
+            "update_id": 1000 + i,
+            "message": {
+                "message_id": i,
+                "from": {
+                    "id": 70437390 + i,
+                    "is_bot": False,
+                    "first_name": "Ahmed",
+                    "last_name": "Shahwan",
+                    "username": f"user{i}",
+                    "language_code": "en",
+                },
+                "chat": {"id": 70437390 + i, "type": "private"},
+                "date": 1555512911,
+                "text": "/translate",
+            },
+        }
+        for i in range(BATCH)
+    ]
+    return json.dumps({"ok": True, "result": updates}).encode("utf-8")
+
+
+def main():
+    body = make_body()
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        parse_updates(body)
+    elapsed = time.perf_counter() - start
+    decoder = loads.__module__
+    print(f"decoder: {decoder}, {BATCH * ROUNDS / elapsed:,.0f} updates/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+    Asyncio runtime
+    Polls for updates in its own task and handles each chat on its own worker,
+    so updates of one chat stay in order while different chats run in parallel
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .metrics import metrics
+from .updates import Update, parse_updates
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+class UpdateTracker:
+    """Tracks the updates being handled out of order, to know the last update below
+    which every update is handled
+
+    Telegram forgets the updates below the polling offset and a restart resumes after
+    the checkpoint, so neither may pass an update that is still being handled"""
+
+    def __init__(self, handled: int = 0):
+        self._lock = threading.Lock()  # checkpoints are asked from handler threads
+        self.handled = handled  # every update up to this one is handled
+        self._pending = set()  # ids of the updates being handled
+        self._done = set()  # ids of handled updates above a pending one
+
+    def start(self, update_id: int) -> bool:
+        """Track ``update_id`` as being handled, False if it's handled or pending"""
+        with self._lock:
+            if (
+                update_id <= self.handled
+                or update_id in self._pending
+                or update_id in self._done
+            ):
+                return False
+            self._pending.add(update_id)
+            return True
+
+    def finish(self, update_id: int):
+        """Track ``update_id`` as handled"""
+        with self._lock:
+            self._pending.discard(update_id)
+            self._done.add(update_id)
+            self.handled = self._handled(self._pending, self._done)
+            self._done = {done for done in self._done if done > self.handled}
+
+    def checkpoint(self, updates: list) -> int:
+        """Returns the update to checkpoint once ``updates`` are handled"""
+        ids = {update.update_id for update in updates}
+        with self._lock:
+            return self._handled(self._pending - ids, self._done | ids)
+
+    def _handled(self, pending: set, done: set) -> int:
+        below = [
+            update_id for update_id in done if not pending or update_id < min(pending)
+        ]
+        return max(below, default=self.handled)
+
+
+class ChatDispatcher:
+    """Routes updates to one sequential worker task per chat
+
+    ``handler`` is a blocking callable taking a list of updates and a ``checkpoint``
+    callable, which returns the update to checkpoint with them (see ``UpdateTracker``).
+    It runs in ``executor`` until the handlers have async versions"""
+
+    def __init__(self, handler, executor, idle_timeout: float = 60.0, handled: int = 0):
+        self.handler = handler
+        self.executor = executor
+        self.idle_timeout = idle_timeout
+        self.tracker = UpdateTracker(handled)
+        self.finished = asyncio.Event()  # set whenever an update is handled
+        self.queues = {}  # chat_id -> asyncio.Queue of pending updates
+        self.workers = {}  # chat_id -> worker task
+
+    def dispatch(self, update: Update) -> bool:
+        """Queue ``update`` on its chat worker, starting the worker if needed
+
+        Returns False for updates already handled or queued"""
+        if not self.tracker.start(update.update_id):
+            return False
+        chat_id = update.chat_id
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = asyncio.Queue()
+            self.workers[chat_id] = asyncio.ensure_future(self._worker(chat_id, queue))
+        queue.put_nowait(update)
+        metrics.gauge("aio.chat_workers", len(self.queues))
+        return True
+
+    async def _worker(self, chat_id, queue: asyncio.Queue):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                update = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():  # nothing arrived while idle, retire the worker
+                    del self.queues[chat_id]
+                    del self.workers[chat_id]
+                    metrics.gauge("aio.chat_workers", len(self.queues))
+                    return
+                continue
+            handle = partial(self.handler, [update], checkpoint=self.tracker.checkpoint)
+            try:
+                await loop.run_in_executor(self.executor, handle)
+            except Exception as err:  # one bad update must not kill the chat worker
+                log.error(f"handling update {update.update_id} failed: {err}")
+            finally:  # a failed update is given up, it must not hold back the others
+                self.tracker.finish(update.update_id)
+                self.finished.set()
+                queue.task_done()
+
+    async def join(self):
+        """Wait until every queued update has been handled"""
+        for queue in list(self.queues.values()):
+            await queue.join()
+
+    async def close(self):
+        """Cancel all chat workers"""
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self.queues.clear()
+        self.workers.clear()
+
+
+async def poll(client, dispatcher: ChatDispatcher, executor):
+    """Long poll ``client`` forever, dispatching every update as it arrives
+
+    The offset only passes handled updates, so Telegram keeps sending the ones being
+    handled until they are: if all it sends are, wait for one to finish"""
+    loop = asyncio.get_event_loop()
+    while True:
+        offset = dispatcher.tracker.handled + 1
+        response = await loop.run_in_executor(executor, client.get_updates, offset)
+        if not response.get("ok"):
+            await asyncio.sleep(1)  # don't hammer the API while it's failing
+            continue
+        updates = parse_updates(response)
+        dispatched = [update for update in updates if dispatcher.dispatch(update)]
+        if updates and not dispatched:
+            await dispatcher.finished.wait()
+            dispatcher.finished.clear()
+
+
+async def run(client, handler, workers: int = 8, offset: int = None):
+    """Run the bot on asyncio: a polling task and per-chat workers
+
+    Polling starts from update ``offset``, every update below it is handled"""
+    executor = ThreadPoolExecutor(workers, thread_name_prefix="handler")
+    # polling gets its own thread so a busy handler pool never delays the next poll
+    poll_executor = ThreadPoolExecutor(1, thread_name_prefix="poll")
+    dispatcher = ChatDispatcher(handler, executor, handled=(offset or 1) - 1)
+    try:
+        await poll(client, dispatcher, poll_executor)
+    finally:
+        executor.shutdown(wait=False)
+        poll_executor.shutdown(wait=False)
@@ -0,0 +1,42 @@
+"""
+    Announcements Module
+    The announcement state machine, stored in ``Announcement.done``:
+
+        new ('' or NULL) --announced--> once --reminded the day before--> twice
+        cancelled --cancellation announced--> twice
+"""
+from loggingconfigs import config_logger
+
+NEW, ONCE, TWICE, CANCELLED = "", "once", "twice", "cancelled"
+# state -> (suffix of the message sent in that state, state after sending it)
+TRANSITIONS = {
+    NEW: ("", ONCE),
+    CANCELLED: (" IS CANCELLED", TWICE),
+    ONCE: (" TOMORROW", TWICE),
+}
+log = config_logger(__name__)
+
+
+def state_of(ann) -> str:
+    return ann.done or NEW
+
+
+def announce_pending(db, outbox, now) -> int:
+    """Queue the messages of every announcement pending at ``now`` (a datetime)
+
+    The messages are queued to every chat together with the move of the
+    announcements to their next state, in one transaction. Returns how many
+    announcements were sent."""
+    pending = [
+        (ann, TRANSITIONS[state_of(ann)])
+        for ann in db.pending_announcements(now)
+        if state_of(ann) in TRANSITIONS
+    ]
+    if not pending:
+        return 0
+    with db.batch():
+        outbox.broadcast([ann.description + suffix for ann, (suffix, _) in pending])
+        db.set_announcement_states([(state, ann.id) for ann, (_, state) in pending])
+    for ann, (_, state) in pending:
+        log.info(f"Sending announcement: {ann} -> {state}")
+    return len(pending)
@@ -0,0 +1,119 @@
+"""
+    Breaker Module
+    Circuit breakers and deadlines for calls to third-party APIs
+"""
+import threading
+import time
+
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+class Unavailable(Exception):
+    """A third-party API can't answer in time"""
+
+
+class CircuitOpen(Unavailable):
+    """The API's circuit breaker is open, it wasn't called"""
+
+
+class DeadlineExceeded(Unavailable):
+    """No time is left to call the API"""
+
+
+class Deadline:
+    """A point in time calls made on behalf of one update must finish by"""
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, connect: float = 3.05):
+        """A ``requests`` (connect, read) timeout ending at the deadline
+
+        Raises DeadlineExceeded if it already passed"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline exceeded")
+        return min(connect, remaining), remaining
+
+
+class CircuitBreaker:
+    """Stops calling an API after ``failure_threshold`` failures in a row
+
+    The breaker is closed (calls go through) until then, open (calls fail fast with
+    CircuitOpen) for ``reset_timeout`` seconds, then half-open: one trial call goes
+    through, closing the breaker if it succeeds or opening it again if it fails.
+    The state is in the shared metrics as the gauge ``breaker.<name>.state``"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # in a row
+        self.opened_at = None
+        self._trial = False  # a half-open trial call is running
+        self._lock = threading.Lock()
+        metrics.gauge(f"breaker.{name}.state", self.state)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            log.info(f"breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        metrics.gauge(f"breaker.{self.name}.state", state)
+
+    def allow(self) -> bool:
+        """Returns whether a call may go through now, callers report its outcome"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    metrics.incr(f"breaker.{self.name}.rejected")
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    metrics.incr(f"breaker.{self.name}.rejected")
+                    return False
+                self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            self._set_state(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    metrics.incr(f"breaker.{self.name}.opened")
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """Returns ``func(*args, **kwargs)``, any exception it raises is a failure
+
+        Raises CircuitOpen without calling ``func`` while the breaker is open"""
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} is unavailable")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
@@ -0,0 +1,83 @@
+"""
+    Cache Module
+    Bounded in-memory caches shared between threads
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import metrics
+
+
+class LRUCache:
+    """Thread-safe LRU cache of at most ``maxsize`` entries, each valid for ``ttl`` seconds
+
+    Hits and misses are counted here and in the shared metrics as ``cache.<name>.*``"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value cached for ``key`` or ``default`` if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                metrics.incr(f"cache.{self.name}.hits")
+                return entry[1]
+            if entry is not None:  # expired
+                del self._data[key]
+            self.misses += 1
+            metrics.incr(f"cache.{self.name}.misses")
+            return default
+
+    def put(self, key, value):
+        """Cache ``value`` under ``key``, evicting the least recently used entry if full"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                metrics.incr(f"cache.{self.name}.evictions")
+
+    def update(self, key, **fields) -> bool:
+        """Set attributes ``fields`` on the object cached under ``key`` (write-through)
+
+        Returns False if ``key`` isn't cached"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            for field, value in fields.items():
+                setattr(entry[1], field, value)
+            return True
+
+    def invalidate(self, key):
+        """Drop ``key`` from the cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Returns size, hits, misses and hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
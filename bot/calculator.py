@@ -0,0 +1,221 @@
+"""
+    Calculator Module
+    Evaluates math expressions locally on a whitelisted subset of Python's AST
+"""
+import ast
+import math
+import operator
+import re
+
+from .cache import LRUCache
+
+MAX_LENGTH = 500  # characters in one expression
+MAX_NODES = 200  # operations (AST nodes) in one expression
+MAX_DIGITS = 1000  # digits of any integer, given or computed
+MAX_EXPONENT = 10000
+MAX_FACTORIAL = 450  # 450! has 1001 digits
+MAX_ROUND_DIGITS = 100  # round(1, -10**7) takes seconds
+# a conversion like "2 inch to cm"
+CONVERSION = re.compile(
+    r"^(?P<expr>.+?)\s*(?P<unit>[a-z]+)\s+(?:to|in)\s+(?P<to>[a-z]+)$"
+)
+
+
+class Unsupported(Exception):
+    """The expression uses syntax the local calculator doesn't handle"""
+
+
+class TooComplex(Exception):
+    """The expression exceeds the calculator's limits"""
+
+
+def _check_int(value):
+    if isinstance(value, int) and value.bit_length() > MAX_DIGITS * 3.33:
+        raise TooComplex("number too big")
+    return value
+
+
+def _power(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        raise TooComplex("exponent too big")
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0:
+        if base.bit_length() * exponent > MAX_DIGITS * 3.33:
+            raise TooComplex("number too big")
+    return base ** exponent
+
+
+def _factorial(n):
+    if n != int(n) or not 0 <= n <= MAX_FACTORIAL:
+        raise TooComplex("factorial argument too big")
+    return math.factorial(int(n))
+
+
+def _round(number, ndigits=None):
+    if ndigits is not None and abs(ndigits) > MAX_ROUND_DIGITS:
+        raise TooComplex("too many digits to round to")
+    return round(number, ndigits)
+
+
+BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _power,
+}
+UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+FUNCTIONS = {
+    "abs": abs,
+    "round": _round,
+    "sqrt": math.sqrt,
+    "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x),
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "sinh": math.sinh,
+    "cosh": math.cosh,
+    "tanh": math.tanh,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "factorial": _factorial,
+    "gcd": math.gcd,
+    "max": max,
+    "min": min,
+}
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau, "phi": (1 + 5 ** 0.5) / 2}
+# unit -> (dimension, size in the dimension's base unit)
+UNITS = {
+    "mm": ("length", 0.001),
+    "cm": ("length", 0.01),
+    "m": ("length", 1.0),
+    "km": ("length", 1000.0),
+    "inch": ("length", 0.0254),
+    "ft": ("length", 0.3048),
+    "yd": ("length", 0.9144),
+    "mi": ("length", 1609.344),
+    "mg": ("mass", 0.001),
+    "g": ("mass", 1.0),
+    "kg": ("mass", 1000.0),
+    "lb": ("mass", 453.59237),
+    "oz": ("mass", 28.349523125),
+    "ms": ("time", 0.001),
+    "s": ("time", 1.0),
+    "min": ("time", 60.0),
+    "h": ("time", 3600.0),
+    "day": ("time", 86400.0),
+    "week": ("time", 604800.0),
+    "deg": ("angle", math.pi / 180),
+    "rad": ("angle", 1.0),
+}
+
+
+def _compile_node(node):
+    """Turn a whitelisted AST node into a function evaluating it"""
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body)
+    if isinstance(node, ast.Constant) or type(node).__name__ == "Num":
+        value = node.value if hasattr(node, "value") else node.n  # ast.Num before 3.8
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise Unsupported(f"unsupported value {value!r}")
+        _check_int(value)
+        return lambda: value
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY:
+        op, left, right = (
+            BINARY[type(node.op)],
+            _compile_node(node.left),
+            _compile_node(node.right),
+        )
+        return lambda: _check_int(op(left(), right()))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY:
+        op, operand = UNARY[type(node.op)], _compile_node(node.operand)
+        return lambda: op(operand())
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        value = CONSTANTS[node.id]
+        return lambda: value
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id in FUNCTIONS
+        and not node.keywords
+    ):
+        func, args = FUNCTIONS[node.func.id], [_compile_node(arg) for arg in node.args]
+        return lambda: _check_int(func(*(arg() for arg in args)))
+    raise Unsupported(f"unsupported syntax: {type(node).__name__}")
+
+
+def _to_python(expr: str) -> str:
+    """Rewrite mathjs syntax we support into python: ``^`` powers, ``n!`` factorials"""
+    expr = expr.replace("^", "**")
+    # 5! -> factorial(5), (2+3)! -> factorial((2+3))
+    return re.sub(r"(\d+(?:\.\d+)?|\([^()]*\))!", r"factorial(\1)", expr)
+
+
+def compile_expression(expr: str):
+    """Returns a function evaluating ``expr``
+
+    Raises Unsupported for syntax outside the whitelist, TooComplex if it's too big"""
+    if len(expr) > MAX_LENGTH:
+        raise TooComplex("expression too long")
+    try:
+        tree = ast.parse(_to_python(expr.strip()), mode="eval")
+    except (SyntaxError, ValueError) as err:
+        raise Unsupported(str(err))
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+        raise TooComplex("too many operations")
+    return _compile_node(tree)
+
+
+def format_number(value) -> str:
+    """Format like mathjs: integers in full, other numbers to 14 significant digits"""
+    if isinstance(value, complex):  # e.g. (-1)^0.5, left to mathjs
+        raise Unsupported("complex result")
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if math.isnan(value):
+        return "NaN"
+    return format(value, ".14g")
+
+
+class Calculator:
+    """Evaluates expressions, caching the compiled function of the most recent ones"""
+
+    def __init__(self, cache_size: int = 1024):
+        self.compiled = LRUCache("calculator", cache_size, ttl=24 * 3600.0)
+
+    def _compiled(self, expr: str):
+        func = self.compiled.get(expr)
+        if func is None:
+            func = compile_expression(expr)
+            self.compiled.put(expr, func)
+        return func
+
+    def evaluate(self, expr: str) -> str:
+        """Returns the result of ``expr`` as text, like mathjs prints it
+
+        Raises Unsupported, TooComplex, or ArithmeticError/ValueError for math errors"""
+        expr = expr.strip()
+        match = CONVERSION.match(expr.lower())
+        if match and match.group("unit") in UNITS and match.group("to") in UNITS:
+            return self._convert(*match.group("expr", "unit", "to"))
+        try:
+            return format_number(self._compiled(expr)())
+        except OverflowError:
+            raise TooComplex("result too big")
+
+    def _convert(self, expr: str, unit: str, to: str) -> str:
+        (dimension, size), (to_dimension, to_size) = UNITS[unit], UNITS[to]
+        if dimension != to_dimension:
+            raise ValueError(f"can't convert {unit} to {to}")
+        value = self._compiled(expr)() * size / to_size
+        return f"{format_number(value)} {to}"
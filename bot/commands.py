@@ -2,16 +2,59 @@
     Commands Module
 """
 
+import ipaddress
 import os
-import sys
-import urllib
+import socket
+import urllib.parse
 import requests
-import tweepy
+from concurrent import futures
 from .db import DBHelper
+from .breaker import CircuitBreaker, Deadline, Unavailable
+from .weather import WeatherService
+from .translation import TranslationMemory
+from .calculator import Calculator, TooComplex, Unsupported
+from .ocr import OcrQueue
+from .twitter import DuplicateTweet, NotConfigured, TweetQueue
+from .metrics import metrics
+from loggingconfigs import config_logger
 
+log = config_logger(__name__)
+# seconds a command may spend on third-party APIs when no deadline is given
+DEFAULT_DEADLINE = 15.0
+# a circuit breaker per third-party API, opened after that many failures in a row
+BREAKERS = {
+    "mathjs": CircuitBreaker("mathjs", failure_threshold=5),
+    "ocr": CircuitBreaker("ocr", failure_threshold=3),
+    "yandex": CircuitBreaker("yandex", failure_threshold=5),
+    "accuweather": CircuitBreaker("accuweather", failure_threshold=3),
+    "twitter": CircuitBreaker("twitter", failure_threshold=3),
+}
+UNAVAILABLE_MESSAGE = "{} is not responding right now, try again later."
 
-def help_command():
-    """Returns available commands with their help messages"""
+
+class ApiError(Exception):
+    """A third-party API answered with a server error"""
+
+
+def api_request(api: str, method: str, url: str, deadline: Deadline = None, **kwargs):
+    """Send a request to ``api`` through its circuit breaker, within ``deadline``
+
+    Raises ``Unavailable`` if the breaker is open or the deadline passed, and
+    ``requests.RequestException`` or ``ApiError`` on failures, which the breaker counts"""
+    deadline = deadline or Deadline(DEFAULT_DEADLINE)
+    timeout = deadline.timeout()  # a late call isn't the API's failure
+
+    def send():
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+        if response.status_code >= 500:
+            raise ApiError(f"{api} answered {response.status_code}")
+        return response
+
+    return BREAKERS[api].call(send)
+
+
+def help_command(deadline: Deadline = None):
+    """Returns available commands with their help messages, ``deadline`` isn't needed"""
     return (
         "Available commands:\n"
         "/help - Show this message\n"
@@ -42,84 +85,218 @@ def start_command(db: DBHelper, user_id: int, updated: int, active: bool):
     )
 
 
-def calculate(expr):
+# evaluates what it can of /calculate locally, see calculate_remote for the rest
+calculator = Calculator()
+
+
+def calculate(expr, deadline: Deadline = None):
     """Calculates ``expr`` and returns the result"""
-    response = requests.get(
-        f"http://api.mathjs.org/v4/?expr={urllib.parse.quote(expr)}"
-    )
+    try:
+        result = calculator.evaluate(expr)
+        metrics.incr("calculator.local")
+        return f"Result: {result}"
+    except TooComplex:
+        return "This expression is too big to calculate"
+    except (ArithmeticError, ValueError, TypeError):
+        return "Error happened. Use a valid expression"
+    except Unsupported:  # mathjs knows more syntax
+        metrics.incr("calculator.remote")
+        return calculate_remote(expr, deadline)
+
+
+def calculate_remote(expr, deadline: Deadline = None):
+    """Calculates ``expr`` with the mathjs.org API and returns the result"""
+    try:
+        response = api_request(
+            "mathjs",
+            "GET",
+            f"http://api.mathjs.org/v4/?expr={urllib.parse.quote(expr)}",
+            deadline,
+        )
+    except (Unavailable, ApiError, requests.RequestException):
+        return UNAVAILABLE_MESSAGE.format("The calculator")
     if response.status_code == 200:
         return f"Result: {response.text}"
     return "Error happened. Use a valid expression"
 
 
-def ocr_url(url, overlay=False, language="eng"):
-    """OCR from image using its ``url``"""
+# bytes of an image we download and upload, ocr.space fetches bigger ones by URL
+MAX_IMAGE_SIZE = 1024 * 1024
+
+
+def check_public_url(url: str):
+    """Raises ValueError unless ``url`` is http(s) on a host with public addresses only
+
+    Keeps the bot from fetching loopback, private or cloud metadata addresses for users"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("only http and https URLs are supported")
+    try:
+        infos = socket.getaddrinfo(
+            parts.hostname, parts.port or 80, 0, socket.SOCK_STREAM
+        )
+    except (socket.gaierror, UnicodeError) as err:
+        raise ValueError(f"can't resolve {parts.hostname}: {err}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise ValueError(f"{parts.hostname} isn't a public host")
+
+
+def download_image(url: str, deadline: Deadline = None) -> bytes:
+    """Returns the image at ``url``, raises on failure, redirects, or if it's too big"""
+    deadline = deadline or Deadline(DEFAULT_DEADLINE)
+    check_public_url(url)
+    with requests.get(
+        url, stream=True, allow_redirects=False, timeout=deadline.timeout()
+    ) as response:
+        response.raise_for_status()
+        if response.is_redirect:  # the target could be anywhere
+            raise ValueError("redirected")
+        content = b""
+        for chunk in response.iter_content(64 * 1024):
+            content += chunk
+            if len(content) > MAX_IMAGE_SIZE:
+                raise ValueError("image too big")
+    return content
+
+
+def fetch_ocr(
+    url, deadline: Deadline = None, content: bytes = None, overlay=False, language="eng"
+) -> str:
+    """Extract the text of the image at ``url`` with ocr.space, raises on failure
+
+    The image ``content`` is uploaded if we downloaded it, otherwise ocr.space
+    fetches ``url`` itself"""
     api_key = os.environ.get("OCR_API")
     payload = {
-        "url": url,
         "isOverlayRequired": overlay,
         "apikey": api_key,
         "language": language,
     }
-    r = requests.post("https://api.ocr.space/parse/image", data=payload)
-    results = r.json()
+    files = None
+    if content is None:
+        payload["url"] = url
+    else:  # the file name's extension tells ocr.space the image type
+        name = os.path.basename(urllib.parse.urlsplit(url).path) or "image"
+        files = {"file": (name, content)}
     try:
-        return results["ParsedResults"][0]["ParsedText"]
-    except Exception:
-        return "Error. Please provide a valid URL"
+        r = api_request(
+            "ocr",
+            "POST",
+            "https://api.ocr.space/parse/image",
+            deadline,
+            data=payload,
+            files=files,
+        )
+    except requests.RequestException as err:  # unlike the image's, this isn't the user's
+        raise Unavailable(f"ocr.space: {err}")
+    return r.json()["ParsedResults"][0]["ParsedText"]
 
 
-def translate(message):
-    """Translate ``message`` from english to arabic"""
-    yandex_token = os.environ.get("YANDEX_TRANSLATE_TOKEN")
-    if not yandex_token:
-        sys.stderr.write("Please Provide Yandex Translate Token")
-        sys.exit(1)
-    response = requests.post(
+def ocr_error_message(err: Exception) -> str:
+    """The answer to an /ocr_url that failed with ``err``"""
+    if isinstance(err, (Unavailable, ApiError)):
+        return UNAVAILABLE_MESSAGE.format("The OCR service")
+    return "Error. Please provide a valid URL"
+
+
+ocr_jobs = OcrQueue(fetch_ocr, download_image, ocr_error_message)
+
+
+def ocr_url(url, deadline: Deadline = None):
+    """OCR from image using its ``url``, waiting for the text
+
+    Updates go through ``ocr_jobs.submit`` instead, which answers in the background"""
+    try:
+        return ocr_jobs.extract(url, deadline)
+    except Exception as err:
+        return ocr_error_message(err)
+
+
+def fetch_translations(texts: list, deadline: Deadline = None) -> list:
+    """Translate ``texts`` from english to arabic in one Yandex request, raises on failure"""
+    response = api_request(
+        "yandex",
+        "POST",
         "https://translate.yandex.net/api/v1.5/tr.json/translate",
-        params={"key": yandex_token, "text": message, "lang": "en-ar"},
+        deadline,
+        params={"key": os.environ.get("YANDEX_TRANSLATE_TOKEN"), "lang": "en-ar"},
+        data={"text": texts},  # repeated ``text`` fields, translated in order
     )
     if response.status_code != 200:
+        raise ValueError(f"yandex answered {response.status_code}")
+    return response.json()["text"]
+
+
+# translations of texts sent before, backed by the db once tea connects it
+translations = TranslationMemory(fetch_translations)
+
+
+def translate(message, deadline: Deadline = None):
+    """Translate ``message`` from english to arabic"""
+    if not os.environ.get("YANDEX_TRANSLATE_TOKEN"):
+        log.warning("Please Provide Yandex Translate Token")
+        return "Translation is not available, try again later."
+    try:
+        return translations.translate(message, deadline)
+    except (Unavailable, ApiError, requests.RequestException):
+        return UNAVAILABLE_MESSAGE.format("Translation")
+    except (ValueError, LookupError, TypeError):
         return "Error Happend, try again later."
-    jsdict = response.json()
-    return jsdict.get("text")[0]  # get text list then get element 0 of it
 
 
-def tweet(text):
+# tweets are posted one at a time, from one client (see bot.twitter)
+tweets = TweetQueue(breaker=BREAKERS["twitter"])
+
+
+def tweet(text, deadline: Deadline = None):
     """Tweet ``text`` to twitter account"""
-    t_api = os.environ.get("TWITTER_API")
-    t_api_secret = os.environ.get("TWITTER_API_SECRET")
-    t_token = os.environ.get("TWITTER_TOKEN")
-    t_token_secret = os.environ.get("TWITTER_TOKEN_SECRET")
-    if not (t_api and t_api_secret and t_token and t_token_secret):
-        sys.stderr.write("Please provide twitter tokens.")
-        sys.exit(1)
-
-    auth = tweepy.OAuthHandler(t_api, t_api_secret)
-    auth.set_access_token(t_token, t_token_secret)
-    api = tweepy.API(auth)
-    result = ""
+    deadline = deadline or Deadline(DEFAULT_DEADLINE)
     try:
-        response = api.update_status(text)
-        tweet_id = response._json["id_str"]
-        tweet_link = f"https://twitter.com/tbot60/status/{tweet_id}"
-        result = f"Your tweet: {tweet_link}"
-    except tweepy.error.TweepError:
-        result = "Do not repeat the same tweet"
-    return result
+        link = tweets.post(text).result(max(0.0, deadline.remaining()))
+    except DuplicateTweet:
+        return "Do not repeat the same tweet"
+    except futures.TimeoutError:  # the queue will still post it
+        return "Your tweet is queued, it will be posted soon."
+    except NotConfigured as err:
+        log.warning(str(err))
+        return "Tweeting is not available, try again later."
+    except Unavailable:
+        return UNAVAILABLE_MESSAGE.format("Twitter")
+    except Exception:
+        return "Error Happend, try again later."
+    return f"Your tweet: {link}"
 
 
-def weather():
-    """Returns weather in Zagazig, Egypt"""
+def fetch_weather(deadline: Deadline = None) -> str:
+    """Fetch the weather in Zagazig, Egypt from AccuWeather, raises on failure"""
     location_key = 127335  # Zagazig location key
     url = f"http://dataservice.accuweather.com/forecasts/v1/hourly/1hour/{location_key}"
     parameters = {"apikey": os.environ.get("ACCUWEATHER"), "metric": True}
-    data = requests.get(url, params=parameters).json()[0]
+    response = api_request("accuweather", "GET", url, deadline, params=parameters)
+    data = response.json()[0]
     temperature = data["Temperature"]["Value"]
     atm_status = data["IconPhrase"]
     location = "Zagazig, Egypt"
     return f"Weather is {atm_status} in {location}.\nAnd it currently feels like {temperature} °C"
 
 
+# the same forecast for everyone, refreshed in the background (see tea.JOBS)
+weather_service = WeatherService(fetch_weather)
+
+
+def weather(deadline: Deadline = None):
+    """Returns weather in Zagazig, Egypt"""
+    try:
+        return weather_service.get(deadline)
+    except (Unavailable, ApiError, requests.RequestException):
+        return UNAVAILABLE_MESSAGE.format("The weather service")
+    except (ValueError, LookupError, TypeError):  # e.g. an error instead of a forecast
+        return "Weather is not available right now, try again later."
+
+
 def stop(db: DBHelper, user_id: int, updated: int, active: bool):
     db.set_user_status(user_id, updated, active)
@@ -0,0 +1,87 @@
+"""
+    Conversation Module
+    Remembers, per user and chat, which command the next text message is an argument to
+"""
+import threading
+import time
+
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+class ConversationStore:
+    """In-memory pending commands keyed by (user_id, chat_id), expiring after ``ttl`` seconds
+
+    The store can be snapshotted to and restored from SQLite with a ``DBHelper``"""
+
+    def __init__(self, ttl: float = 1800.0):
+        self.ttl = ttl
+        self._states = {}  # (user_id, chat_id) -> (command, expires unix time)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def set(self, user_id: int, chat_id: int, command: str):
+        """Remember ``command`` as the pending command of the conversation"""
+        with self._lock:
+            self._states[(user_id, chat_id)] = (command, time.time() + self.ttl)
+
+    def get(self, user_id: int, chat_id: int) -> str:
+        """Returns the pending command of the conversation or None, and extends its expiry"""
+        key = (user_id, chat_id)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return None
+            command, expires = state
+            now = time.time()
+            if expires <= now:
+                del self._states[key]
+                return None
+            self._states[key] = (command, now + self.ttl)
+            return command
+
+    def clear(self, user_id: int, chat_id: int):
+        """Forget the pending command of the conversation"""
+        with self._lock:
+            self._states.pop((user_id, chat_id), None)
+
+    def __len__(self):
+        return len(self._states)
+
+    def snapshot(self, db) -> int:
+        """Save the unexpired states to ``db``, returns how many were saved"""
+        now = time.time()
+        with self._lock:
+            rows = [
+                (user_id, chat_id, command, expires)
+                for (user_id, chat_id), (command, expires) in self._states.items()
+                if expires > now
+            ]
+        db.save_conversations(rows)
+        log.debug("conversation snapshot: " + str(len(rows)) + " states")
+        return len(rows)
+
+    def restore(self, db) -> int:
+        """Load the unexpired states saved in ``db``, returns how many were loaded"""
+        rows = db.get_conversations(time.time())
+        with self._lock:
+            for user_id, chat_id, command, expires in rows:
+                self._states[(user_id, chat_id)] = (command, expires)
+        log.info("restored " + str(len(rows)) + " conversation states")
+        return len(rows)
+
+    def start_snapshots(self, db, interval: float = 60.0):
+        """Snapshot to ``db`` every ``interval`` seconds on a background thread"""
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.snapshot(db)
+                except Exception as err:  # keep snapshotting on the next tick
+                    log.error("conversation snapshot failed: " + str(err))
+
+        threading.Thread(target=run, name="conversations", daemon=True).start()
+
+    def stop_snapshots(self):
+        self._stop.set()
@@ -1,12 +1,29 @@
 """
     Types stored in DB.
     Will be used to create instances of Users, Messages when retrieved from DB.
+    They use ``__slots__`` (no per-instance ``__dict__``) since many are kept in
+    caches, and ``from_row`` can be used as a sqlite3 cursor ``row_factory``.
 """
 
 
 class User:
     """User type"""
 
+    __slots__ = (
+        "id",
+        "is_bot",
+        "is_admin",
+        "first_name",
+        "last_name",
+        "username",
+        "language_code",
+        "active",
+        "created",
+        "updated",
+        "last_command",
+        "chat_id",
+    )
+
     def __init__(
         self,
         id: int,
@@ -35,6 +52,11 @@ class User:
         self.last_command = last_command
         self.chat_id = chat_id
 
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Build a User from a ``SELECT * FROM User`` row"""
+        return cls(*row)
+
     def __str__(self):
         return (
             f"[<User>: id: {self.id}, is_bot: {self.is_bot}, is_admin: {self.is_admin}, "
@@ -47,6 +69,8 @@ class User:
 class Message:
     """Message type"""
 
+    __slots__ = ("id", "update_id", "user_id", "chat_id", "date", "text")
+
     def __init__(
         self, id: int, update_id: int, user_id: int, chat_id: int, date: int, text: str
     ):
@@ -57,6 +81,11 @@ class Message:
         self.date = date
         self.text = text
 
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Build a Message from a ``SELECT * FROM Message`` row"""
+        return cls(*row)
+
     def __str__(self):
         return (
             f"[<Message>: id: {self.id}, update_id: {self.update_id}, user_id: {self.user_id}, "
@@ -67,12 +96,19 @@ class Message:
 class Announcement:
     """Event type"""
 
+    __slots__ = ("time", "description", "done", "id")
+
     def __init__(self, time: str, description: str, done: str, id: int = None):
         self.time = time
         self.description = description
         self.done = done
         self.id = id
 
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Build an Announcement from an ``id, time, description, done`` row"""
+        return cls(row[1], row[2], row[3], row[0])
+
     def __str__(self):
         return (
             f"[<Announcement>: id: {self.id}, time: {self.time}, description: {self.description}, "
@@ -83,12 +119,19 @@ class Announcement:
 class ScheduleEntry:
     """Schedule Entry type"""
 
+    __slots__ = ("id", "time", "subject", "day")
+
     def __init__(self, time: int, subject: str, day: str, id: int = None):
         self.id = id
         self.time = time
         self.subject = subject
         self.day = day
 
+    @classmethod
+    def from_row(cls, cursor, row):
+        """Build a ScheduleEntry from a ``SELECT * FROM Schedule`` row"""
+        return cls(row[1], row[2], row[3], row[0])
+
     def __str__(self):
         return (
             f"[<ScheduleEntry>: id: {self.id}, time: {self.time}, subject: {self.subject}, "
@@ -0,0 +1,40 @@
+"""
+    Date helpers
+    The bot runs on Cairo time (UTC+2), announcement times are written as "DD-MM HH:MM"
+"""
+from datetime import datetime, timedelta, timezone
+
+CAIRO = timezone(timedelta(hours=2))  # Cairo time = UTC+2
+
+
+def now_in_cairo() -> datetime:
+    """Returns the current time in Cairo"""
+    return datetime.now(CAIRO)
+
+
+def parse_announcement_due(text: str, year: int = None, now: datetime = None) -> int:
+    """Returns the unix timestamp of the day an announcement ``text`` ("DD-MM ...") is due
+
+    Without a ``year`` the date's next occurrence after ``now`` (default: now) is
+    used, unless it passed less than half a year ago (e.g. "01-03" written in December
+    is due next March). The day starts at midnight Cairo time. Returns None if
+    ``text`` has no valid date."""
+    try:
+        day, month = (int(part) for part in text.split(" ")[0].split("-"))
+        if year is not None:
+            due = datetime(year, month, day, tzinfo=CAIRO)
+        else:
+            now = now or now_in_cairo()
+            due = datetime(now.year, month, day, tzinfo=CAIRO)
+            if due < now - timedelta(days=182):
+                due = datetime(now.year + 1, month, day, tzinfo=CAIRO)
+    except (AttributeError, ValueError):
+        return None
+    return int(due.timestamp())
+
+
+def day_bounds(moment: datetime, days_ahead: int = 0) -> tuple:
+    """Returns unix timestamps (start, end) of the Cairo day ``days_ahead`` after ``moment``"""
+    day = moment.astimezone(CAIRO).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = day + timedelta(days=days_ahead)
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
@@ -2,54 +2,362 @@
     Database management module
 """
 import os
+import queue
 import sys
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from itertools import groupby
 from pathlib import Path
 
 from sqlite3 import Error
 from .data_types import User, Message, ScheduleEntry, Announcement
+from .cache import LRUCache
+from .metrics import metrics
+from .dates import parse_announcement_due, day_bounds
 from loggingconfigs import config_logger
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 DB_DIR = os.path.join(BASE_DIR, "db")
 DB_SQL_SCRIPT = os.path.join(BASE_DIR, "db", "bot.db.m1.sql")
+DB_INDEX_SCRIPT = os.path.join(BASE_DIR, "db", "bot.db.m2.sql")
+# columns added after m1, as (table, column, declaration)
+DB_COLUMNS = (("Announcement", "due", "INTEGER"), ("Outbox", "broadcast", "INTEGER"))
+# ``INSERT ... RETURNING`` needs sqlite 3.35+
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# applied to every connection, readers and writer
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",  # durable with WAL, no fsync per commit
+    "PRAGMA mmap_size = 268435456",  # 256MB memory-mapped reads
+    "PRAGMA cache_size = -16000",  # 16MB page cache
+    "PRAGMA busy_timeout = 5000",
+)
 log = config_logger(__name__)
 
 
+def locked(method):
+    """Serialize calls to ``method`` on the helper's connection lock
+
+    The writer connection and its shared cursor are used by executor threads in async mode"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        with self.lock:
+            metrics.observe("db.writer.wait", time.perf_counter() - start)
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class DBHelper:
-    def __init__(self, filename="bot.db"):
+    def __init__(
+        self,
+        filename="bot.db",
+        flush_size=500,
+        flush_interval=1.0,
+        user_cache_size=10000,
+        user_cache_ttl=600.0,
+        readers=4,
+        chunk_size=500,
+    ):
         try:
             self.db_file = str(os.path.join(DB_DIR, filename))
-            self.conn = sqlite3.connect(self.db_file)  # new db connection
+            self.lock = threading.RLock()
+            # write-behind buffers, one per thread, see ``batch``
+            self.flush_size = flush_size  # max writes held before a flush
+            self.flush_interval = flush_interval  # max seconds a write is held
+            self._local = threading.local()
+            # recently used users by id, kept in sync by the set_user_* methods
+            self.user_cache = LRUCache("user", user_cache_size, user_cache_ttl)
+            # the writer connection, shared between threads under ``self.lock``
+            self.conn = self._connect()
+            self.conn.execute(
+                "PRAGMA journal_mode = WAL"
+            )  # readers don't block the writer
             self.cur = self.conn.cursor()  # obtain a cursor
+            self.chunk_size = chunk_size  # rows fetched at a time by ``iter_*`` methods
+            # read-only connections, checked out by ``reader``
+            self._readers = queue.Queue()
+            for _ in range(readers):
+                reader = self._connect()
+                reader.execute("PRAGMA query_only = 1")
+                self._readers.put(reader)
             log.info("DB Initialized.")
         except Error as err:
             exit(err)
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open a tuned connection to the db file, usable from any thread"""
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _batch_state(self):
+        """This thread's ``batch``: nesting ``depth``, held writes in ``pending``, and
+        whether it's the ``owner`` of the writer's open transaction"""
+        state = self._local
+        if not hasattr(state, "depth"):
+            state.depth, state.pending, state.pending_since = 0, [], None
+            state.owner = False
+        return state
+
+    @property
+    def _batching(self) -> int:
+        return self._batch_state().depth
+
+    @property
+    def _pending(self) -> list:
+        return self._batch_state().pending
+
+    @contextmanager
+    def reader(self):
+        """Check out a connection to read from
+
+        A thread with held writes of its own reads from the writer, so it sees them,
+        as does any thread while the writer is free with uncommitted writes. Otherwise
+        a pooled reader is used, which WAL lets run alongside the writer and which only
+        sees committed writes."""
+        start = time.perf_counter()
+        state = self._batch_state()
+        if state.pending or state.owner:
+            self.lock.acquire()
+        elif not self.lock.acquire(blocking=False):  # another thread's writes
+            with self._pooled_reader(start) as conn:
+                yield conn
+            return
+        try:
+            if state.pending or self.conn.in_transaction:
+                metrics.observe("db.reader.wait", time.perf_counter() - start)
+                self._apply_pending()  # read our own held writes
+                yield self.conn
+                return
+        finally:
+            self.lock.release()
+        with self._pooled_reader(start) as conn:
+            yield conn
+
+    @contextmanager
+    def _pooled_reader(self, start: float = None):
+        """Check out a connection from the reader pool, waiting for a free one"""
+        start = start or time.perf_counter()
+        conn = self._readers.get()
+        metrics.observe("db.reader.wait", time.perf_counter() - start)
+        metrics.gauge("db.readers.idle", self._readers.qsize())
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @staticmethod
+    def _typed(conn: sqlite3.Connection, data_type=None) -> sqlite3.Cursor:
+        """A new cursor on ``conn`` building ``data_type`` objects straight from rows"""
+        cursor = conn.cursor()
+        if data_type is not None:
+            cursor.row_factory = data_type.from_row
+        return cursor
+
+    def _stream(self, sql: str, params: tuple = (), data_type=None):
+        """Yield rows of ``sql`` fetched ``chunk_size`` at a time from a pooled reader
+
+        Rows are built as ``data_type`` objects if given. Only committed rows are
+        seen. The reader stays checked out until the generator is exhausted or
+        closed, so consume it promptly."""
+        with self._pooled_reader() as conn:
+            cursor = self._typed(conn, data_type).execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        return
+                    yield from rows
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def writer(self):
+        """Check out the writer connection, the caller commits"""
+        start = time.perf_counter()
+        with self.lock:
+            metrics.observe("db.writer.wait", time.perf_counter() - start)
+            self._apply_pending()  # keep the order of held writes
+            yield self.conn
+
+    def _close_readers(self):
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    @locked
     def setup(self) -> bool:
         """Set up database for dev/test purpose or for first time use"""
         try:
             self.conn.executescript(Path(DB_SQL_SCRIPT).read_text())
+            self._add_columns()
+            self.conn.executescript(Path(DB_INDEX_SCRIPT).read_text())
             log.debug("DB file path: " + self.db_file)
             log.info("DB setup was successful.")
         except Error as err:
             exit(err)
         return True
 
+    def _add_columns(self):
+        """Add ``DB_COLUMNS`` missing from tables created by older versions"""
+        for table, column, declaration in DB_COLUMNS:
+            columns = [
+                row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")
+            ]
+            if column not in columns:
+                self.conn.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {column} {declaration}"
+                )
+                log.info(f"added column {table}.{column}")
+        self.conn.commit()
+        self.fill_announcement_dues()  # saved before the column existed
+
+    @locked
+    def fill_announcement_dues(self, now=None) -> int:
+        """Set the due date of announcements missing one, returns how many were set
+
+        Announcements are also added or edited by hand, leaving ``due`` NULL (see the
+        AnnouncementTimeUpdated trigger); ``now`` (a datetime) picks their year"""
+        sql = "SELECT id, time FROM Announcement WHERE due IS NULL"
+        try:
+            with self.reader() as conn:
+                rows = conn.execute(sql).fetchall()
+            updates = [(parse_announcement_due(text, now=now), id) for id, text in rows]
+            updates = [(due, id) for due, id in updates if due is not None]
+            with self.batch():
+                for row in updates:
+                    self._write("UPDATE Announcement SET due = ? WHERE id = ?", row)
+            return len(updates)
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
     def destroy(self):
         try:
             self.conn.execute("DROP TABLE User;")
             self.conn.execute("DROP TABLE Message;")
             self.conn.execute("DROP TABLE Announcement;")
             self.conn.execute("DROP TABLE Schedule;")
+            self.conn.execute("DROP TABLE Conversation;")
+            self.conn.execute("DROP TABLE BotState;")
+            self.conn.execute("DROP TABLE Outbox;")
+            self.conn.execute("DROP TABLE Translation;")
             self.conn.commit()
+            self.user_cache.clear()
             log.info("dropping tables... done.")
             self.conn.close()
-            os.remove(self.db_file)
+            self._close_readers()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.db_file + suffix):
+                    os.remove(self.db_file + suffix)
             log.info("removing db file... done.")
         except Error as err:
             exit(err)
 
+    @contextmanager
+    def batch(self):
+        """Hold the writes this thread makes inside the ``with`` block and commit them in
+        one transaction, or roll them back if the block raises
+
+        Writes are flushed early when ``flush_size`` is reached or the oldest one is
+        ``flush_interval`` seconds old. Reads on this thread still see the held writes,
+        other threads' writes and commits don't touch them."""
+        state = self._batch_state()
+        state.depth += 1
+        try:
+            yield self
+        except BaseException:  # e.g. KeyboardInterrupt on SIGTERM
+            state.depth -= 1
+            if not state.depth:
+                self._rollback_batch()
+            raise
+        state.depth -= 1
+        if not state.depth:
+            self.flush()
+
+    @locked
+    def flush(self) -> bool:
+        """Execute this thread's held writes with ``executemany`` and commit them"""
+        state = self._batch_state()
+        if not (state.pending or self.conn.in_transaction):
+            return True
+        count = len(state.pending)
+        try:
+            self._apply_pending()
+            self.conn.commit()
+            log.debug("flushed " + str(count) + " writes")
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+        finally:
+            self._release_writer()
+
+    @locked
+    def _rollback_batch(self):
+        """Drop this thread's held writes and roll back its open transaction"""
+        state = self._batch_state()
+        state.pending, state.pending_since = [], None
+        if state.owner:
+            self.conn.rollback()
+            self.user_cache.clear()  # may hold rolled back users
+            self._release_writer()
+        log.info("batch rolled back")
+
+    def _hold_writer(self):
+        """Keep the writer locked until this thread's batch commits, so another thread
+        can't commit its transaction half done (called under ``self.lock``)"""
+        state = self._batch_state()
+        if state.depth and not state.owner:
+            self.lock.acquire()
+            state.owner = True
+
+    def _release_writer(self):
+        state = self._batch_state()
+        if state.owner:
+            state.owner = False
+            self.lock.release()
+
+    @locked
+    def close(self):
+        """Flush held writes and close the connection"""
+        self.flush()
+        self.conn.close()
+        self._close_readers()
+        log.info("DB closed.")
+
+    def _apply_pending(self):
+        """Run this thread's held writes inside the open transaction, without committing"""
+        state = self._batch_state()
+        self._hold_writer()
+        pending, state.pending, state.pending_since = state.pending, [], None
+        # group runs of the same statement, keeping the order between statements
+        for sql, group in groupby(pending, key=lambda write: write[0]):
+            self.cur.executemany(sql, [params for _, params in group])
+
+    def _write(self, sql: str, params: tuple):
+        """Execute and commit a write, or hold it while inside ``batch``"""
+        state = self._batch_state()
+        if not state.depth:
+            self.cur.execute(sql, params)
+            self.conn.commit()
+            return
+        if not state.pending:
+            state.pending_since = time.monotonic()
+        state.pending.append((sql, params))
+        if (
+            len(state.pending) >= self.flush_size
+            or time.monotonic() - state.pending_since >= self.flush_interval
+        ):
+            self.flush()
+
+    @locked
     def add_message(self, message: Message) -> bool:
         """Insert a new Message
 
@@ -65,8 +373,7 @@ class DBHelper:
             message.text,
         )
         try:
-            self.cur.execute(sql, params)
-            self.conn.commit()
+            self._write(sql, params)
             log.debug("Message Content: " + message.text)
             log.info("Message Added with id: " + str(message.id))
             return True
@@ -74,14 +381,36 @@ class DBHelper:
             self.conn.rollback()
             exit(err)
 
+    @locked
+    def ingest_message(self, message: Message) -> bool:
+        """Insert ``message`` unless a message with its id is already stored
+
+        Replayed updates (e.g. after a restart) are ignored without a lookup"""
+        sql = "INSERT OR IGNORE INTO Message VALUES (?, ?, ?, ?, ?, ?)"
+        params = (
+            message.id,
+            message.update_id,
+            message.user_id,
+            message.chat_id,
+            message.date,
+            message.text,
+        )
+        try:
+            self._write(sql, params)
+            log.info("Message ingested with id: " + str(message.id))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
     def get_message(self, message_id: int) -> Message:
         """Retrieve message by its id"""
         sql = "SELECT * FROM Message WHERE id = ?"
         try:
-            self.cur.execute(sql, (message_id,))
-            rows = [row for row in self.cur.fetchall()]
+            with self.reader() as conn:
+                rows = self._typed(conn, Message).execute(sql, (message_id,)).fetchall()
             if rows:
-                msg = Message(*rows[0])
+                msg = rows[0]
                 log.debug("Message Content: " + str(msg.text))
                 log.info("Message Retrieved with id: " + str(msg.id))
                 return msg
@@ -91,6 +420,7 @@ class DBHelper:
         except Error as err:
             exit(err)
 
+    @locked
     def add_user(self, user: User) -> bool:
         """Insert a new user"""
         sql = "INSERT INTO User VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -109,8 +439,7 @@ class DBHelper:
             user.chat_id,
         )
         try:
-            self.cur.execute(sql, params)
-            self.conn.commit()
+            self._write(sql, params)
             log.debug("User data:" + str(params))
             log.info("adding new user... done")
             return True
@@ -118,17 +447,70 @@ class DBHelper:
             self.conn.rollback()
             exit(err)
 
+    @locked
+    def upsert_user(self, user: User) -> User:
+        """Insert ``user`` if new, otherwise fill in a missing chat_id, and return the stored user
+
+        Old users keep their saved data (status, last command...), only an empty
+        chat_id is set from ``user``"""
+        cached = self.user_cache.get(user.id)
+        if cached is not None and cached.chat_id:
+            return cached  # nothing to insert or fill in
+        sql = (
+            "INSERT INTO User VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET "
+            "chat_id = COALESCE(User.chat_id, excluded.chat_id), "
+            "updated = CASE WHEN User.chat_id IS NULL "
+            "THEN excluded.updated ELSE User.updated END"
+        )
+        params = (
+            user.id,
+            user.is_bot,
+            user.is_admin,
+            user.first_name,
+            user.last_name,
+            user.username,
+            user.language_code,
+            user.active,
+            user.created,
+            user.updated,
+            user.last_command,
+            user.chat_id,
+        )
+        try:
+            self._apply_pending()  # keep the order of held writes
+            cursor = self._typed(self.conn, User)
+            if HAS_RETURNING:
+                rows = cursor.execute(sql + " RETURNING *", params).fetchall()
+            else:  # sqlite < 3.35, read the row back
+                cursor.execute(sql, params)
+                rows = cursor.execute(
+                    "SELECT * FROM User WHERE id = ?", (user.id,)
+                ).fetchall()
+            if not self._batching:
+                self.conn.commit()
+            user = rows[0]
+            log.debug("User data: " + str(user))
+            self.user_cache.put(user.id, user)
+            return user
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
     def get_user(self, user_id: int) -> User:
         """Get a user object using ``user_id``"""
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
         sql = "SELECT * FROM User WHERE id = ?"
-        user = None
         try:
-            result = self.cur.execute(sql, (user_id,))
-            fetched_data = result.fetchone()
+            with self.reader() as conn:
+                user = self._typed(conn, User).execute(sql, (user_id,)).fetchone()
             log.info("getting user with id: " + str(user_id))
-            log.debug("User data: " + str(fetched_data))
-            if isinstance(fetched_data, tuple):
-                user = User(*fetched_data)
+            log.debug("User data: " + str(user))
+            if user is not None:
+                self.user_cache.put(user.id, user)
             if user:
                 return user
             return None
@@ -138,22 +520,28 @@ class DBHelper:
     def get_users(self) -> list:
         """Return list of all Users"""
         sql = "SELECT * FROM User"
-        users_list = []
         try:
-            for user in self.cur.execute(sql).fetchall():
-                users_list.append(User(*user))
-            return users_list
+            with self.reader() as conn:
+                return self._typed(conn, User).execute(sql).fetchall()
         except Error as err:
             exit(err)
 
+    def iter_users(self):
+        """Yield all Users, streamed in chunks"""
+        try:
+            yield from self._stream("SELECT * FROM User", data_type=User)
+        except Error as err:
+            exit(err)
+
+    @locked
     def set_user_last_command(
         self, user_id: int, updated: int, last_command: str
     ) -> bool:
         """Update user's last command"""
         sql = "UPDATE User SET updated = ?, last_command = ? WHERE id = ?"
         try:
-            self.cur.execute(sql, (updated, last_command, user_id))
-            self.conn.commit()
+            self._write(sql, (updated, last_command, user_id))
+            self.user_cache.update(user_id, updated=updated, last_command=last_command)
             log.info(
                 "last command updated for user ID: "
                 + str(user_id)
@@ -165,6 +553,7 @@ class DBHelper:
             self.conn.rollback()
             exit(err)
 
+    @locked
     def set_user_status(self, user_id: int, updated: int, active: int) -> bool:
         """Activate/deactivate a user"""
         status = 0
@@ -172,8 +561,8 @@ class DBHelper:
             status = 1
         sql = "UPDATE User SET updated = ?, active = ? WHERE id = ?"
         try:
-            self.cur.execute(sql, (updated, status, user_id))
-            self.conn.commit()
+            self._write(sql, (updated, status, user_id))
+            self.user_cache.update(user_id, updated=updated, active=bool(status))
             if status:
                 log.info("User: " + str(user_id) + " is activated.")
             else:
@@ -183,12 +572,269 @@ class DBHelper:
             self.conn.rollback()
             exit(err)
 
+    @locked
     def set_user_chat_id(self, user_id: int, updated: int, chat_id: int) -> bool:
         """Set user's chat_id if not set (for old users)"""
         sql = "UPDATE User SET updated = ?, chat_id = ? WHERE id = ?"
         try:
-            self.cur.execute(sql, (updated, chat_id, user_id))
-            self.conn.commit()
+            self._write(sql, (updated, chat_id, user_id))
+            self.user_cache.update(user_id, updated=updated, chat_id=chat_id)
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
+    def save_conversations(self, rows: list) -> bool:
+        """Replace saved conversation states with ``rows``
+
+        ``rows`` list of tuple(``user_id``: int, ``chat_id``: int, ``command``: str, ``expires``: float)"""
+        try:
+            self._apply_pending()
+            self.cur.execute("DELETE FROM Conversation")
+            self.cur.executemany("INSERT INTO Conversation VALUES (?, ?, ?, ?)", rows)
+            if not self._batching:
+                self.conn.commit()
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    def get_conversations(self, now: float) -> list:
+        """Returns saved conversation states that expire after ``now``"""
+        sql = "SELECT user_id, chat_id, command, expires FROM Conversation WHERE expires > ?"
+        try:
+            with self.reader() as conn:
+                return conn.execute(sql, (now,)).fetchall()
+        except Error as err:
+            exit(err)
+
+    def get_state(self, key: str, default=None):
+        """Returns the saved bot state value of ``key``, or ``default``"""
+        sql = "SELECT value FROM BotState WHERE key = ?"
+        try:
+            with self.reader() as conn:
+                row = conn.execute(sql, (key,)).fetchone()
+            return default if row is None else row[0]
+        except Error as err:
+            exit(err)
+
+    @locked
+    def set_state(self, key: str, value) -> bool:
+        """Save bot state ``key`` as ``value``"""
+        sql = "INSERT OR REPLACE INTO BotState VALUES (?, ?)"
+        try:
+            self._write(sql, (key, value))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
+    def checkpoint_update(self, update_id: int) -> bool:
+        """Record ``update_id`` as handled unless a later update already is
+
+        Inside a batch it commits together with the writes of the handled updates"""
+        sql = (
+            "INSERT INTO BotState VALUES ('update_id', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)"
+        )
+        try:
+            self._write(sql, (update_id,))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    def get_update_checkpoint(self) -> int:
+        """Returns the id of the last handled update, 0 if none was handled yet"""
+        return self.get_state("update_id", 0)
+
+    @locked
+    def enqueue_messages(self, rows: list, now: float = None) -> bool:
+        """Queue outgoing messages, ``rows`` are (chat_id, text) tuples"""
+        sql = (
+            "INSERT INTO Outbox (chat_id, text, next_attempt_at, created) "
+            "VALUES (?, ?, ?, ?)"
+        )
+        now = now or time.time()
+        try:
+            with self.batch():
+                for chat_id, text in rows:
+                    self._write(sql, (chat_id, text, now, now))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
+    def enqueue_broadcast(
+        self, texts: list, now: float = None, chat_ids: list = None
+    ) -> int:
+        """Queue each of ``texts`` to ``chat_ids``, every active chat by default, all
+        in one transaction
+
+        Rows are inserted text after text, so every chat gets the texts in order;
+        active chats straight from the User table. Returns the broadcast's id, see
+        ``broadcast_progress``"""
+        sql = (
+            "INSERT INTO Outbox (broadcast, chat_id, text, next_attempt_at, created) "
+            "SELECT ?, chat_id, ?, ?, ? FROM User "
+            "WHERE active = 1 AND chat_id IS NOT NULL ORDER BY chat_id"
+        )
+        chat_sql = (
+            "INSERT INTO Outbox (broadcast, chat_id, text, next_attempt_at, created) "
+            "VALUES (?, ?, ?, ?, ?)"
+        )
+        now = now or time.time()
+        try:
+            with self.batch():
+                self._apply_pending()  # the id is taken in the batch's transaction
+                self.cur.execute(
+                    "INSERT INTO BotState VALUES ('broadcast', 1) "
+                    "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+                )
+                broadcast = self.cur.execute(
+                    "SELECT value FROM BotState WHERE key = 'broadcast'"
+                ).fetchone()[0]
+                for text in texts:
+                    if chat_ids is None:
+                        self._write(sql, (broadcast, text, now, now))
+                    else:
+                        for chat_id in chat_ids:
+                            self._write(chat_sql, (broadcast, chat_id, text, now, now))
+            return broadcast
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    def broadcast_progress(self, broadcast: int) -> dict:
+        """Returns the number of messages of ``broadcast`` by status, and their total"""
+        sql = "SELECT status, COUNT(*) FROM Outbox WHERE broadcast = ? GROUP BY status"
+        try:
+            with self.reader() as conn:
+                progress = {"pending": 0, "sent": 0, "failed": 0}
+                progress.update(conn.execute(sql, (broadcast,)).fetchall())
+            progress["total"] = sum(progress.values())
+            return progress
+        except Error as err:
+            exit(err)
+
+    def due_messages(self, now: float, limit: int = 500) -> list:
+        """Returns up to ``limit`` pending messages due at ``now``, oldest first
+
+        Direct messages (replies) come before broadcast ones, so they don't wait
+        for a broadcast to go out. Rows are (id, chat_id, text, attempts) tuples"""
+        sql = (
+            "SELECT id, chat_id, text, attempts FROM Outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? "
+            "ORDER BY broadcast IS NOT NULL, id LIMIT ?"
+        )
+        try:
+            with self.reader() as conn:
+                return conn.execute(sql, (now, limit)).fetchall()
+        except Error as err:
+            exit(err)
+
+    @locked
+    def record_deliveries(
+        self, sent: list = (), retries: list = (), failed: list = (), deferred=()
+    ) -> bool:
+        """Save delivery results of Outbox messages, in one transaction
+
+        ``sent`` and ``failed`` are message ids, ``retries`` (failed attempts) and
+        ``deferred`` (not attempted) are (next_attempt_at, id) tuples"""
+        try:
+            with self.batch():
+                for id in sent:
+                    self._write(
+                        "UPDATE Outbox SET status = 'sent', attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (id,),
+                    )
+                for row in retries:
+                    self._write(
+                        "UPDATE Outbox SET attempts = attempts + 1, next_attempt_at = ? "
+                        "WHERE id = ?",
+                        row,
+                    )
+                for id in failed:
+                    self._write(
+                        "UPDATE Outbox SET status = 'failed', attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (id,),
+                    )
+                for row in deferred:
+                    self._write(
+                        "UPDATE Outbox SET next_attempt_at = ? WHERE id = ?", row
+                    )
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
+    def purge_outbox(self, before: float) -> bool:
+        """Delete sent and failed messages queued before ``before``"""
+        sql = "DELETE FROM Outbox WHERE status != 'pending' AND created < ?"
+        try:
+            self._write(sql, (before,))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    def get_translation(self, key: str) -> str:
+        """Returns the saved translation of normalized text ``key``, or None"""
+        sql = "SELECT text FROM Translation WHERE key = ?"
+        try:
+            with self.reader() as conn:
+                row = conn.execute(sql, (key,)).fetchone()
+            return row[0] if row else None
+        except Error as err:
+            exit(err)
+
+    @locked
+    def save_translations(self, rows: list, now: float = None) -> bool:
+        """Save translations, ``rows`` are (key, text) tuples"""
+        sql = "INSERT OR REPLACE INTO Translation (key, text, used) VALUES (?, ?, ?)"
+        now = now or time.time()
+        try:
+            with self.batch():
+                for key, text in rows:
+                    self._write(sql, (key, text, now))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
+    def touch_translation(self, key: str, now: float = None) -> bool:
+        """Count a hit of translation ``key`` and mark it as recently used"""
+        sql = "UPDATE Translation SET hits = hits + 1, used = ? WHERE key = ?"
+        try:
+            self._write(sql, (now or time.time(), key))
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    def count_translations(self) -> int:
+        try:
+            with self.reader() as conn:
+                return conn.execute("SELECT COUNT(*) FROM Translation").fetchone()[0]
+        except Error as err:
+            exit(err)
+
+    @locked
+    def evict_translations(self, count: int) -> bool:
+        """Delete the ``count`` least recently used translations"""
+        sql = (
+            "DELETE FROM Translation WHERE key IN "
+            "(SELECT key FROM Translation ORDER BY used LIMIT ?)"
+        )
+        try:
+            self._write(sql, (count,))
             return True
         except Error as err:
             self.conn.rollback()
@@ -197,14 +843,16 @@ class DBHelper:
     def get_schedule(self) -> list:
         """Fetch schedule data"""
         sql = "SELECT * FROM Schedule"
-        schedule_entries = []
         try:
-            result = self.cur.execute(sql)
-            for entry in result.fetchall():
-                schedule_entries.append(
-                    ScheduleEntry(entry[1], entry[2], entry[3], entry[0])
-                )
-            return schedule_entries
+            with self.reader() as conn:
+                return self._typed(conn, ScheduleEntry).execute(sql).fetchall()
+        except Error as err:
+            exit(err)
+
+    def iter_schedule(self):
+        """Yield all ScheduleEntries, streamed in chunks"""
+        try:
+            yield from self._stream("SELECT * FROM Schedule", data_type=ScheduleEntry)
         except Error as err:
             exit(err)
 
@@ -213,19 +861,22 @@ class DBHelper:
         sql = "SELECT time, subject FROM Schedule WHERE day = ?"
         schedule = []
         try:
-            result = self.cur.execute(sql, (day,))
-            for entry in result.fetchall():
+            with self.reader() as conn:
+                rows = conn.execute(sql, (day,)).fetchall()
+            for entry in rows:
                 schedule.append(entry)
             return schedule
         except Error as err:
             print(err, file=sys.stderr)
             return []
 
+    @locked
     def add_announcement(self, ann: Announcement) -> bool:
         """Create new Announcement"""
-        sql = "INSERT INTO Announcement (time, description, done) VALUES (?, ?, ?)"
+        sql = "INSERT INTO Announcement (time, description, done, due) VALUES (?, ?, ?, ?)"
+        due = parse_announcement_due(ann.time)
         try:
-            self.cur.execute(sql, (ann.time, ann.description, ann.done))
+            self._write(sql, (ann.time, ann.description, ann.done, due))
             return True
         except Error as err:
             self.conn.rollback()
@@ -233,17 +884,57 @@ class DBHelper:
 
     def get_announcements(self) -> list:
         """Retrieve description and time field from Announcement"""
-        sql = "SELECT * FROM Announcement"
-        ann_list = []
+        sql = "SELECT id, time, description, done FROM Announcement"
+        try:
+            with self.reader() as conn:
+                return self._typed(conn, Announcement).execute(sql).fetchall()
+        except Error as err:
+            exit(err)
+
+    def iter_announcements(self):
+        """Yield all Announcements, streamed in chunks"""
+        sql = "SELECT id, time, description, done FROM Announcement"
+        try:
+            yield from self._stream(sql, data_type=Announcement)
+        except Error as err:
+            exit(err)
+
+    def pending_announcements(self, now) -> list:
+        """Announcements that have something to send at ``now`` (a datetime)
+
+        New ('' or NULL) and cancelled ones that aren't past due, and ones sent once
+        that are due tomorrow. See ``bot.announcements`` for the states. Due dates
+        missing from announcements written by hand are filled first."""
+        sql = (
+            "SELECT id, time, description, done FROM Announcement "
+            "WHERE ((done IS NULL OR done IN ('', 'cancelled')) "
+            "AND (due IS NULL OR due >= ?)) "
+            "OR (done = 'once' AND due >= ? AND due < ?) ORDER BY id"
+        )
+        today, _ = day_bounds(now)
+        self.fill_announcement_dues(now)
         try:
-            result = self.cur.execute(sql)
-            for ann in result.fetchall():
-                ann_obj = Announcement(ann[1], ann[2], ann[3], ann[0])
-                ann_list.append(ann_obj)
-            return ann_list
+            with self.reader() as conn:
+                cursor = self._typed(conn, Announcement)
+                params = (today, *day_bounds(now, days_ahead=1))
+                return cursor.execute(sql, params).fetchall()
         except Error as err:
             exit(err)
 
+    @locked
+    def set_announcement_states(self, rows: list) -> bool:
+        """Move announcements to new states, ``rows`` are (done, id) tuples"""
+        sql = "UPDATE Announcement SET done = ? WHERE id = ?"
+        try:
+            with self.batch():
+                for row in rows:
+                    self._write(sql, row)
+            return True
+        except Error as err:
+            self.conn.rollback()
+            exit(err)
+
+    @locked
     def update_announcement(self, id: int, done: str):
         """Update ann.done"""
         values = ["once", "twice", "cancelled"]
@@ -251,8 +942,7 @@ class DBHelper:
             exit("You must provide a valid done value")
         sql = "UPDATE Announcement SET done = ? WHERE id = ?"
         try:
-            self.cur.execute(sql, (done, id))
-            self.conn.commit()
+            self._write(sql, (done, id))
             return True
         except Error as err:
             self.conn.rollback()
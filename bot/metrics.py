@@ -0,0 +1,69 @@
+"""
+    Metrics Module
+    Thread-safe in-process counters and timers, logged or inspected by the bot
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """A registry of named counters, gauges and timers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}  # name -> [count, total, max]
+
+    def incr(self, name: str, value: int = 1):
+        """Increment counter ``name`` by ``value``"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value):
+        """Set gauge ``name`` to ``value``"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        """Record one duration sample of ``seconds`` for timer ``name``"""
+        with self._lock:
+            timer = self._timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time the body of a ``with`` block into timer ``name``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def counter(self, name: str) -> int:
+        """Returns the current value of counter ``name``"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """Returns a copy of all metrics, timers as count/avg/max"""
+        with self._lock:
+            timers = {
+                name: {
+                    "count": count,
+                    "avg": total / count if count else 0.0,
+                    "max": longest,
+                }
+                for name, (count, total, longest) in self._timers.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timers": timers,
+            }
+
+
+metrics = Metrics()  # shared registry used across the bot
@@ -0,0 +1,120 @@
+"""
+    OCR Module
+    Runs /ocr_url jobs in the background, with results cached by URL and image content
+"""
+import hashlib
+import threading
+from functools import partial
+
+from .breaker import Deadline
+from .cache import LRUCache
+from .metrics import metrics
+from .workers import CommandPool
+from loggingconfigs import config_logger
+
+DONE, PROCESSING, BUSY = "done", "processing", "busy"
+PROCESSING_MESSAGE = "Processing your image, I'll send you its text when it's ready."
+log = config_logger(__name__)
+
+
+class OcrQueue:
+    """OCR jobs answered through a ``reply`` callable once the text is extracted
+
+    ``download(url, deadline) -> bytes`` fetches the image and ``ocr(url, deadline,
+    content)`` extracts its text, from the downloaded ``content`` or from ``url`` if
+    downloading failed; both raise on failure. OCR failures are answered with
+    ``error_message(err)`` and aren't cached. Texts are cached by URL and by the
+    SHA-256 of the image, so an image shared under another URL is only downloaded.
+    Requests for a URL that is already being processed wait for that job."""
+
+    def __init__(
+        self,
+        ocr,
+        download,
+        error_message,
+        workers: int = 2,
+        queue_size: int = 16,
+        timeout: float = 120.0,
+        cache_size: int = 512,
+        ttl: float = 24 * 3600.0,
+    ):
+        self.ocr = ocr
+        self.download = download
+        self.error_message = error_message
+        self.timeout = timeout
+        self.pool = CommandPool(
+            workers,
+            queue_size,
+            limit=lambda command: workers + queue_size,
+            timeout=timeout,
+        )
+        self.by_url = LRUCache("ocr.url", cache_size, ttl)
+        self.by_content = LRUCache("ocr.content", cache_size, ttl)
+        self._waiting = {}  # url -> replies waiting for its job
+        self._lock = threading.Lock()
+
+    def submit(self, url: str, reply) -> str:
+        """Answer ``url`` through ``reply``, now if it's cached or later from a worker
+
+        Returns DONE if ``reply`` was already called, PROCESSING if it will be, or
+        BUSY if the queue is full and it won't"""
+        url = url.strip()
+        text = self.by_url.get(url)
+        if text is not None:
+            reply(text)
+            return DONE
+        with self._lock:
+            waiting = self._waiting.get(url)
+            if waiting is not None:
+                waiting.append(reply)
+                metrics.incr("ocr.coalesced")
+                return PROCESSING
+            self._waiting[url] = [reply]
+        job = partial(self._job, url, Deadline(self.timeout))
+        if not self.pool.submit("/ocr_url", job, (), partial(self._answer, url)):
+            with self._lock:
+                del self._waiting[url]
+            return BUSY
+        return PROCESSING
+
+    def _job(self, url: str, deadline: Deadline) -> str:
+        try:
+            return self.extract(url, deadline)
+        except Exception as err:
+            log.info(f"OCR of {url} failed: {err}")
+            return self.error_message(err)
+
+    def extract(self, url: str, deadline: Deadline = None) -> str:
+        """Returns the text of the image at ``url``, raises if it can't be extracted"""
+        url = url.strip()
+        text = self.by_url.get(url)
+        if text is not None:
+            return text
+        try:
+            content = self.download(url, deadline)
+        except Exception as err:  # e.g. a private host, ocr.space may still reach it
+            log.info(f"OCR of {url} by URL only: {err}")
+            metrics.incr("ocr.url_only")
+            content = digest = text = None
+        else:
+            digest = hashlib.sha256(content).hexdigest()
+            text = self.by_content.get(digest)
+        if text is None:
+            with metrics.timer("ocr.extract"):
+                text = self.ocr(url, deadline, content)
+            if digest is not None:
+                self.by_content.put(digest, text)
+        self.by_url.put(url, text)
+        return text
+
+    def _answer(self, url: str, text: str):
+        with self._lock:
+            replies = self._waiting.pop(url, [])
+        for reply in replies:
+            try:
+                reply(text)
+            except Exception as err:
+                log.error(f"answering OCR of {url} failed: {err}")
+
+    def shutdown(self, wait: bool = True):
+        self.pool.shutdown(wait)
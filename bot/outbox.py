@@ -0,0 +1,197 @@
+"""
+    Outbox Module
+    Outgoing messages are saved to the Outbox table, then delivered by a sender worker
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .ratelimit import GLOBAL_RATE, PER_CHAT_RATE, TokenBucket, PerChatLimiter
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+MAX_LENGTH = 4096  # characters Telegram accepts in one message
+log = config_logger(__name__)
+
+
+def split_message(text: str, limit: int = MAX_LENGTH) -> list:
+    """Split ``text`` into chunks of at most ``limit`` characters
+
+    Chunks end at the last line break, or else space, that fits"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 1, limit + 1)
+        if cut == -1:
+            cut = text.rfind(" ", 1, limit + 1)
+        if cut == -1:  # one long word
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:  # the separator is dropped
+            chunks.append(text[:cut])
+            text = text[cut + 1 :]
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class Outbox:
+    """Crash-safe delivery of outgoing messages
+
+    ``send`` and ``broadcast`` only queue messages in ``db``; a sender thread delivers
+    the due ones within Telegram's rate limits, retrying failed attempts with
+    exponential backoff (or after the delay a 429 asks for) up to ``max_attempts``.
+    Queued messages survive a restart, so a broadcast resumes with the chats it
+    didn't reach yet. At most ``workers`` chats are handed to the workers at a time,
+    direct messages first, so a reply doesn't queue behind a whole broadcast. ``client`` is anything with ``send_message(chat_id, text) -> dict``"""
+
+    def __init__(
+        self,
+        db,
+        client,
+        workers: int = 8,
+        global_rate: float = GLOBAL_RATE,
+        per_chat_rate: float = PER_CHAT_RATE,
+        max_attempts: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+        poll_interval: float = 1.0,
+        batch_size: int = 500,
+    ):
+        self.db = db
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size  # max messages read from the db at a time
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat = PerChatLimiter(per_chat_rate)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="outbox")
+        self._busy = set()  # chats being delivered to, one worker per chat keeps order
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def send(self, chat_id: int, text: str):
+        """Queue ``text`` to ``chat_id``, split if it's too long; empty texts aren't sent"""
+        if chat_id and text:
+            self.db.enqueue_messages(
+                [(chat_id, chunk) for chunk in split_message(text)]
+            )
+            self.wake()
+
+    def broadcast(self, text, chat_ids: list = None) -> int:
+        """Queue ``text`` (a message or a list of messages) to ``chat_ids``, every
+        active chat by default
+
+        Returns the broadcast's id, to follow it with ``progress``"""
+        texts = [text] if isinstance(text, str) else list(text)
+        texts = [chunk for message in texts for chunk in split_message(message)]
+        broadcast = self.db.enqueue_broadcast(texts, chat_ids=chat_ids)
+        self.wake()
+        log.info(f"broadcast {broadcast} queued: {len(texts)} messages")
+        return broadcast
+
+    def progress(self, broadcast: int) -> dict:
+        """Returns the ``total`` messages of ``broadcast`` and how many are ``pending``,
+        ``sent`` and ``failed``"""
+        return self.db.broadcast_progress(broadcast)
+
+    def wake(self):
+        """Look for due messages now instead of at the next poll"""
+        self._wake.set()
+
+    def start(self):
+        """Deliver messages on a background thread until ``stop``"""
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stopped:
+            self._wake.clear()
+            try:
+                self.deliver_due()
+            except Exception as err:  # keep delivering on the next poll
+                log.error(f"outbox delivery failed: {err}")
+            self._wake.wait(self.poll_interval)
+
+    def deliver_due(self, now: float = None) -> list:
+        """Hand the messages due at ``now`` to free workers, grouped by chat
+
+        Chats come in the order of their first due message, chats already being
+        delivered to are skipped until their worker is done. Returns the futures of
+        the started deliveries."""
+        rows = self.db.due_messages(now or time.time(), self.batch_size)
+        metrics.gauge("outbox.due", len(rows))
+        chats = {}  # chat_id -> its messages, in the order chats come up
+        for row in rows:
+            chats.setdefault(row[1], []).append(row)
+        futures = []
+        for chat_id, messages in chats.items():
+            with self._lock:
+                if len(self._busy) >= self.workers:
+                    break  # the next poll, woken by a finished chat, goes on
+                if chat_id in self._busy:
+                    continue
+                self._busy.add(chat_id)
+            messages.sort()  # in queue order
+            futures.append(self.executor.submit(self._deliver_chat, chat_id, messages))
+        return futures
+
+    def _deliver_chat(self, chat_id: int, messages: list):
+        """Send ``messages`` to ``chat_id`` in order and save the results
+
+        After a failed attempt the rest of the chat's messages wait for its retry"""
+        sent, retries, failed, deferred = [], [], [], []
+        try:
+            for idx, (id, _, text, attempts) in enumerate(messages):
+                response = self._send(chat_id, text)
+                if response.get("ok"):
+                    sent.append(id)
+                    continue
+                delay = self._retry_delay(response, attempts + 1)
+                if delay is None:
+                    log.info(f"outbox: message {id} to {chat_id} failed: {response}")
+                    failed.append(id)
+                    continue
+                retry_at = time.time() + delay
+                retries.append((retry_at, id))
+                deferred = [(retry_at, message[0]) for message in messages[idx + 1 :]]
+                break
+        finally:
+            self.db.record_deliveries(sent, retries, failed, deferred)
+            with self._lock:
+                self._busy.discard(chat_id)
+            self.wake()  # a worker is free
+            metrics.incr("outbox.sent", len(sent))
+            metrics.incr("outbox.retried", len(retries))
+            metrics.incr("outbox.failed", len(failed))
+
+    def _send(self, chat_id: int, text: str) -> dict:
+        self.bucket.acquire()
+        self.per_chat.acquire(chat_id)
+        try:
+            return self.client.send_message(chat_id, text)
+        except Exception as err:  # treated like a network error, retried
+            return {"ok": False, "description": str(err)}
+
+    def _retry_delay(self, response: dict, attempts: int) -> float:
+        """Seconds to wait before retrying, None if the message should fail now"""
+        if attempts >= self.max_attempts:
+            return None
+        code = response.get("error_code")
+        if code == 429:
+            return response.get("parameters", {}).get("retry_after", 1)
+        if code is None or code >= 500:  # network or Telegram errors
+            return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return None  # e.g. 403, the user blocked the bot: retrying won't help
+
+    def stop(self, wait: bool = True):
+        """Stop the sender, optionally waiting for deliveries in progress"""
+        self._stopped = True
+        self.wake()
+        if self._thread:
+            self._thread.join()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,62 @@
+"""
+    Rate Limit Module
+    Limiters spacing out calls to rate-limited APIs
+"""
+import threading
+import time
+
+# Telegram allows ~30 messages/second overall and ~1 message/second per chat
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens/second up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token, return how long to wait before it's actually available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class PerChatLimiter:
+    """Spaces messages to the same chat at least ``1 / rate`` seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = {}  # chat_id -> monotonic time of next allowed send
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id: int):
+        """Block until ``chat_id`` may receive another message"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(chat_id, now))
+            self._next_slot[chat_id] = slot + self.interval
+            if len(self._next_slot) > 10000:  # forget chats whose slot is over
+                self._next_slot = {
+                    chat: t for chat, t in self._next_slot.items() if t > now
+                }
+        if slot > now:
+            time.sleep(slot - now)
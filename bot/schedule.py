@@ -0,0 +1,70 @@
+"""
+    Schedule Module
+    Daily schedule messages, compiled once from the Schedule table and cached per weekday
+"""
+import threading
+from collections import defaultdict
+
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+# bumped by the Schedule triggers (db/bot.db.m2.sql) on every edit
+VERSION_KEY = "schedule_version"
+
+
+def clock(time: str) -> tuple:
+    """Sort key of an "H:MM"/"HH:MM" schedule time"""
+    try:
+        hours, minutes = time.split(":")
+        return int(hours), int(minutes)
+    except ValueError:  # malformed times go last
+        return 24, 0
+
+
+def render_schedule(day: str, entries: list) -> str:
+    """The morning message of ``day`` listing ``entries`` as (time, subject) in order"""
+    lines = "".join(
+        f"{idx}. {subject} at {time}\n"
+        for idx, (time, subject) in enumerate(entries, 1)
+    )
+    return (
+        "Good morning, \n"
+        "today is {0} and the schedule is: \n\n"
+        "{1}".format(day.title(), lines)
+    )
+
+
+class ScheduleMessages:
+    """Rendered schedule message of every weekday, sorted by time
+
+    The messages are rebuilt only when the schedule version saved in the db changes,
+    so a lookup costs a single BotState read instead of querying and formatting the
+    schedule"""
+
+    def __init__(self, db):
+        self.db = db
+        self.version = None  # schedule version the messages were built from
+        self._messages = {}  # day -> message
+        self._lock = threading.Lock()
+
+    def message_of(self, day: str) -> str:
+        """Returns the schedule message of ``day`` (e.g. "monday")"""
+        version = self.db.get_state(VERSION_KEY, 0)
+        with self._lock:
+            if version != self.version:
+                self._compile(version)
+            message = self._messages.get(day)
+        return message if message is not None else render_schedule(day, [])
+
+    def _compile(self, version: int):
+        days = defaultdict(list)
+        for entry in self.db.iter_schedule():
+            days[entry.day].append((entry.time, entry.subject))
+        self._messages = {
+            day: render_schedule(day, sorted(entries, key=lambda e: clock(e[0])))
+            for day, entries in days.items()
+        }
+        self.version = version
+        metrics.incr("schedule.compiled")
+        log.info(f"compiled schedule messages, version {version}")
@@ -0,0 +1,200 @@
+"""
+    Scheduler Module
+    Runs jobs at cron-like times on a background thread, remembering their runs in the DB
+"""
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+
+from .dates import CAIRO
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+class CronSpec:
+    """A cron-like time spec: "minute hour day month weekday" (weekday 0 = Sunday)
+
+    Each field is ``*``, a number, a range ``a-b``, a step ``*/n`` or a list of these
+    (``a,b-c``). A day has to match both the day and weekday fields."""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, spec: str):
+        fields = spec.split()
+        if len(fields) != len(self.RANGES):
+            raise ValueError(f'cron spec needs 5 fields, got "{spec}"')
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high)
+            for field, (low, high) in zip(fields, self.RANGES)
+        )
+        # every time of a matching day, in order
+        self.times = [
+            dtime(h, m) for h in sorted(self.hours) for m in sorted(self.minutes)
+        ]
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(bound) for bound in part.split("-"))
+            else:
+                start = end = int(part)
+            if not low <= start <= end <= high:
+                raise ValueError(f'"{field}" is out of range {low}-{high}')
+            values.update(range(start, end + 1, int(step or 1)))
+        return frozenset(values)
+
+    def matches_day(self, day) -> bool:
+        return (
+            day.day in self.days
+            and day.month in self.months
+            and (day.weekday() + 1) % 7 in self.weekdays  # python weekday 0 = Monday
+        )
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Returns the first time matching the spec after ``moment``, in its timezone"""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 4):  # any valid day comes around within 4 years
+            if self.matches_day(day):
+                for at in self.times:
+                    fire = datetime.combine(day, at, moment.tzinfo)
+                    if fire >= start:
+                        return fire
+            day += timedelta(days=1)
+        raise ValueError(f'cron spec "{self.spec}" never fires')
+
+    def __repr__(self):
+        return f"CronSpec({self.spec!r})"
+
+
+class Job:
+    """A scheduled callable, ``next_run`` is the unix time of its next run
+
+    ``due`` is the time the spec fired for that run, ``next_run`` is later when a
+    failed run is retried"""
+
+    __slots__ = ("name", "spec", "tz", "func", "grace", "due", "next_run")
+
+    def __init__(self, name: str, spec: CronSpec, tz, func, grace: float):
+        self.name = name
+        self.spec = spec
+        self.tz = tz
+        self.func = func
+        self.grace = grace
+        self.due = self.next_run = None
+
+    def schedule_after(self, moment: float):
+        self.due = self.next_run = self.spec.next_after(
+            datetime.fromtimestamp(moment, self.tz)
+        ).timestamp()
+
+    def __repr__(self):
+        return f"Job({self.name!r}, {self.spec.spec!r}, next_run={self.next_run})"
+
+
+class Scheduler:
+    """Runs jobs when their cron spec fires, in order of their next run (a heap)
+
+    The time of a job's last run is saved in the ``BotState`` of ``db`` as
+    ``job:<name>``. After a restart a run missed less than ``grace`` seconds ago is
+    made up once, and a run that already happened isn't repeated. A failed run is
+    rolled back and retried every ``retry_delay`` seconds while within ``grace``."""
+
+    def __init__(self, db=None, retry_delay: float = 60.0):
+        self.db = db
+        self.retry_delay = retry_delay
+        self._heap = []  # (next_run, seq, job)
+        self._seq = itertools.count()  # breaks ties between jobs due together
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, name: str, spec: str, tz, func, grace: float = 3600.0) -> Job:
+        """Schedule ``func()`` to run at the times of cron ``spec`` in timezone ``tz``"""
+        job = Job(name, CronSpec(spec), tz or CAIRO, func, grace)
+        now = time.time()
+        last_run = self.db.get_state("job:" + name) if self.db else None
+        # resume after the last run, if it's recent enough to make up what was missed
+        job.schedule_after(now if last_run is None else max(last_run, now - grace))
+        with self._cond:
+            heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+            self._cond.notify()
+        log.info(f"scheduled {job}")
+        return job
+
+    def run_pending(self, now: float = None) -> int:
+        """Run the jobs due at ``now``, returns how many ran"""
+        now = now or time.time()
+        ran = 0
+        while True:
+            with self._cond:
+                if not self._heap or self._heap[0][0] > now:
+                    return ran
+                _, _, job = heapq.heappop(self._heap)
+            ran += 1
+            if self._run(job) or now + self.retry_delay >= job.due + job.grace:
+                # runs missed meanwhile collapse into this one
+                job.schedule_after(max(job.due, now))
+            else:
+                job.next_run = now + self.retry_delay
+            with self._cond:
+                heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+
+    def _run(self, job: Job) -> bool:
+        """Run ``job``, returns whether it succeeded
+
+        The job's writes commit together with its run, or roll back if it fails"""
+        log.info(f"running {job}")
+        metrics.observe(f"scheduler.{job.name}.lag", max(0.0, time.time() - job.due))
+        try:
+            if not self.db:
+                self._call(job)
+                return True
+            with self.db.batch():
+                self._call(job)
+                self.db.set_state("job:" + job.name, job.due)
+            return True
+        except Exception as err:  # a failing job must not stop the others
+            metrics.incr(f"scheduler.{job.name}.errors")
+            log.error(f"job {job.name} failed: {err}")
+            return False
+
+    @staticmethod
+    def _call(job: Job):
+        with metrics.timer(f"scheduler.{job.name}"):
+            job.func()
+
+    def start(self):
+        """Run jobs on a background thread until ``stop``"""
+        self._thread = threading.Thread(
+            target=self._loop, name="scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                delay = self._heap[0][0] - time.time() if self._heap else None
+                if delay is None or delay > 0:
+                    self._cond.wait(delay)  # until the next run, a new job or stop
+                    continue
+            self.run_pending()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,94 @@
+"""
+    Telegram Bot API client
+    Keeps one pooled keep-alive session to api.telegram.org for all calls
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+from .updates import loads
+from loggingconfigs import config_logger
+
+API_URL = "https://api.telegram.org/bot{token}/"
+log = config_logger(__name__)
+
+
+class TelegramClient:
+    """Thin client over the Telegram Bot API
+
+    ``connect_timeout`` and ``read_timeout`` are in seconds, long polls add their
+    own poll timeout on top of ``read_timeout``"""
+
+    def __init__(
+        self,
+        token: str,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 10.0,
+        pool_size: int = 20,
+    ):
+        self.base_url = API_URL.format(token=token)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def call(
+        self, method: str, payload: dict = None, read_timeout: float = None
+    ) -> dict:
+        """POST ``payload`` as JSON to API ``method`` and return the decoded response"""
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                self.base_url + method, json=payload or {}, timeout=timeout
+            )
+            result = loads(response.content)
+        except (requests.RequestException, ValueError) as err:
+            metrics.incr(f"telegram.{method}.errors")
+            log.error(f"telegram {method} failed: {err}")
+            return {"ok": False, "description": str(err)}
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe(f"telegram.{method}", elapsed)
+            log.debug(f"telegram {method} took {elapsed * 1000:.1f} ms")
+        if not result.get("ok"):
+            metrics.incr(f"telegram.{method}.errors")
+        return result
+
+    def get_updates(self, offset: int = None, timeout: int = 20) -> dict:
+        """Long poll for updates after ``offset``"""
+        payload = {"timeout": timeout, "allowed_updates": ["message"]}
+        if offset:
+            payload["offset"] = offset  # add offset if exists
+            log.debug("update offset: " + str(offset))
+        return self.call(
+            "getUpdates", payload, read_timeout=timeout + self.read_timeout
+        )
+
+    def send_message(self, chat_id: int, text: str) -> dict:
+        """Send ``text`` to ``chat_id``"""
+        return self.call("sendMessage", {"chat_id": chat_id, "text": text})
+
+    def set_webhook(self, url: str, secret_token: str) -> dict:
+        """Ask Telegram to POST updates to ``url`` with ``secret_token`` in a header
+
+        Updates are sent over one connection, so they arrive in order like with
+        getUpdates (the default of 40 parallel connections reorders them)"""
+        payload = {
+            "url": url,
+            "secret_token": secret_token,
+            "allowed_updates": ["message"],
+            "max_connections": 1,
+        }
+        return self.call("setWebhook", payload)
+
+    def delete_webhook(self) -> dict:
+        """Remove the webhook so getUpdates works again"""
+        return self.call("deleteWebhook")
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
@@ -0,0 +1,158 @@
+"""
+    Translation Module
+    A translation memory: texts translated once are answered from memory or SQLite
+"""
+import threading
+import time
+
+from .breaker import DeadlineExceeded
+from .cache import LRUCache
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+def normalize(text: str) -> str:
+    """The memory key of ``text``: lowercase, with whitespace collapsed"""
+    return " ".join(text.split()).lower()
+
+
+class _Request:
+    """A text waiting in a batch for its translation"""
+
+    __slots__ = ("text", "result", "error", "done")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class TranslationMemory:
+    """Translations by normalized text, in an LRU cache in front of the db
+
+    Texts missing from both are translated by ``fetch(texts, deadline) -> list``.
+    Misses arriving within ``window`` seconds of each other share one ``fetch`` of
+    up to ``batch_size`` texts, and the same text is only fetched once. The db keeps
+    at most ``max_entries`` translations, the least recently used are evicted."""
+
+    def __init__(
+        self,
+        fetch,
+        db=None,
+        front_size: int = 2048,
+        max_entries: int = 50000,
+        window: float = 0.05,
+        batch_size: int = 32,
+    ):
+        self.fetch = fetch
+        self.front = LRUCache("translation", front_size, ttl=24 * 3600.0)
+        self.max_entries = max_entries
+        self.window = window
+        self.batch_size = batch_size
+        self.db_hits = 0
+        self.misses = 0
+        self.db = None
+        self.entries = 0  # translations saved in the db
+        self._batch = None  # key -> _Request, collecting misses while open
+        self._lock = threading.Lock()
+        if db is not None:
+            self.connect(db)
+
+    def connect(self, db):
+        """Back the memory with ``db``, without one translations are kept in memory only"""
+        self.db = db
+        self.entries = db.count_translations()
+
+    def translate(self, text: str, deadline=None) -> str:
+        """Returns the translation of ``text``, raises the fetch error if it failed"""
+        key = normalize(text)
+        translation = self.front.get(key)
+        if translation is not None:
+            return translation
+        if self.db is not None:
+            translation = self.db.get_translation(key)
+            if translation is not None:
+                self.db_hits += 1
+                metrics.incr("translation.db_hits")
+                self.db.touch_translation(key)
+                self.front.put(key, translation)
+                return translation
+        self.misses += 1
+        metrics.incr("translation.fetched")
+        return self._fetch(key, text, deadline)
+
+    def _fetch(self, key: str, text: str, deadline) -> str:
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = {}
+            request = self._batch.get(key)
+            if request is None:
+                request = self._batch[key] = _Request(text)
+        if leader:
+            time.sleep(self.window)  # let concurrent misses join the batch
+            with self._lock:
+                batch, self._batch = self._batch, None
+            self._send(batch, deadline)
+        else:
+            request.done.wait(deadline.remaining() if deadline else None)
+        if request.error is not None:
+            raise request.error
+        if not request.done.is_set():
+            raise DeadlineExceeded("translation timed out")
+        return request.result
+
+    def _send(self, batch: dict, deadline):
+        """Fetch the translations of ``batch`` in chunks of ``batch_size`` and save them"""
+        keys = list(batch)
+        try:
+            for start in range(0, len(keys), self.batch_size):
+                chunk = keys[start : start + self.batch_size]
+                results = self.fetch([batch[key].text for key in chunk], deadline)
+                if len(results) != len(chunk):
+                    raise ValueError(
+                        f"{len(results)} translations of {len(chunk)} texts"
+                    )
+                metrics.observe("translation.batch", len(chunk))
+                for key, result in zip(chunk, results):
+                    self.front.put(key, result)
+                    batch[key].result = result
+                if self.db is not None:
+                    self.db.save_translations(list(zip(chunk, results)))
+                    self._evict(len(chunk))
+        except Exception as err:  # everyone in the batch gets the error
+            for request in batch.values():
+                if request.result is None:
+                    request.error = err
+        finally:
+            for request in batch.values():
+                if request.result is None and request.error is None:
+                    request.error = LookupError("no translation")
+                request.done.set()
+
+    def _evict(self, added: int):
+        """Keep the db under ``max_entries``, evicting a tenth when it's full"""
+        with self._lock:
+            self.entries += added
+            if self.entries <= self.max_entries:
+                return
+            count = self.entries - self.max_entries + self.max_entries // 10
+            self.entries -= count
+        self.db.evict_translations(count)
+        metrics.incr("translation.evictions", count)
+        log.info(f"evicted {count} translations")
+
+    def stats(self) -> dict:
+        """Returns memory and db hits, fetched misses, hit rate and db size"""
+        front = self.front.stats()
+        lookups = front["hits"] + self.db_hits + self.misses
+        return {
+            "memory_hits": front["hits"],
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (front["hits"] + self.db_hits) / lookups if lookups else 0.0,
+            "entries": self.entries,
+        }
@@ -0,0 +1,163 @@
+"""
+    Twitter Module
+    Posts tweets from one long-lived client, queued to stay within Twitter's rate limits
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import tweepy
+
+from .breaker import CircuitBreaker, CircuitOpen, Unavailable
+from .ratelimit import TokenBucket
+from .cache import LRUCache
+from .metrics import metrics
+from .translation import normalize
+from loggingconfigs import config_logger
+
+TWEET_URL = "https://twitter.com/tbot60/status/{}"
+TWEET_RATE = 300 / (3 * 3600.0)  # Twitter allows 300 tweets per 3 hours
+CREDENTIALS = (
+    "TWITTER_API",
+    "TWITTER_API_SECRET",
+    "TWITTER_TOKEN",
+    "TWITTER_TOKEN_SECRET",
+)
+# tweepy 4 renamed TweepError
+TweepError = getattr(tweepy, "TweepError", None) or tweepy.errors.TweepyException
+log = config_logger(__name__)
+
+
+class NotConfigured(Exception):
+    """The Twitter credentials aren't set"""
+
+
+class DuplicateTweet(Exception):
+    """The same text was tweeted recently"""
+
+
+def connect(timeout: float = 10.0):
+    """Returns a ``tweepy.API`` authenticated from the environment
+
+    Raises NotConfigured if a credential is missing"""
+    api_key, api_secret, token, token_secret = map(os.environ.get, CREDENTIALS)
+    if not (api_key and api_secret and token and token_secret):
+        raise NotConfigured("Please provide twitter tokens.")
+    auth = tweepy.OAuthHandler(api_key, api_secret)
+    auth.set_access_token(token, token_secret)
+    return tweepy.API(auth, timeout=timeout)
+
+
+class TweetQueue:
+    """Posts tweets in order on a background thread, from one lazily connected client
+
+    ``connect()`` returns the client, it's called for the first post and again after
+    it raised. Posts are spaced by a token bucket of ``rate`` tweets/second, and a
+    429 pauses posting until Twitter's limit resets (at most ``max_pause`` seconds).
+    Texts posted or queued in the last ``recent_ttl`` seconds are rejected locally as
+    duplicates instead of by Twitter."""
+
+    def __init__(
+        self,
+        connect=connect,
+        breaker: CircuitBreaker = None,
+        rate: float = TWEET_RATE,
+        burst: int = 10,
+        recent_size: int = 1024,
+        recent_ttl: float = 24 * 3600.0,
+        max_pause: float = 900.0,
+    ):
+        self.connect = connect
+        self.breaker = breaker or CircuitBreaker("twitter", failure_threshold=3)
+        self.bucket = TokenBucket(rate, burst)
+        self.recent = LRUCache("twitter.recent", recent_size, recent_ttl)
+        self.max_pause = max_pause
+        self._api = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def api(self):
+        with self._lock:
+            if self._api is None:
+                self._api = self.connect()
+            return self._api
+
+    def post(self, text: str) -> Future:
+        """Queue ``text``, returns a future of the tweet's link
+
+        Raises DuplicateTweet if the same text was posted or queued recently"""
+        key = normalize(text)
+        future = Future()
+        with self._lock:
+            if self.recent.get(key) is not None:
+                metrics.incr("twitter.duplicates")
+                raise DuplicateTweet(text)
+            self.recent.put(key, future)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="twitter", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((key, text, future))
+        metrics.gauge("twitter.queued", self._queue.qsize())
+        return future
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            key, text, future = item
+            metrics.gauge("twitter.queued", self._queue.qsize())
+            try:
+                future.set_result(self._post(text))
+            except Exception as err:
+                if not isinstance(err, DuplicateTweet):
+                    self.recent.invalidate(key)  # it may be tweeted again
+                log.info(f"tweeting failed: {err}")
+                future.set_exception(err)
+
+    def _post(self, text: str) -> str:
+        """Tweet ``text`` now, returns its link"""
+        for attempt in range(2):
+            self.bucket.acquire()
+            api = self.api
+            if not self.breaker.allow():
+                raise CircuitOpen("twitter is unavailable")
+            try:
+                status = api.update_status(text)
+            except TweepError as err:
+                response = getattr(err, "response", None)
+                code = response.status_code if response is not None else None
+                if code is None or code >= 500:  # twitter itself failed
+                    self.breaker.failure()
+                    raise Unavailable(f"twitter: {err}")
+                self.breaker.success()
+                if code == 429:
+                    if attempt == 0:
+                        self._pause(response)
+                        continue
+                    raise Unavailable("twitter: rate limited")
+                if code == 403:  # how Twitter rejects duplicates
+                    raise DuplicateTweet(text)
+                raise
+            self.breaker.success()
+            metrics.incr("twitter.posted")
+            return TWEET_URL.format(status._json["id_str"])
+
+    def _pause(self, response):
+        """Sleep until the rate limit in ``response`` resets"""
+        reset = float(response.headers.get("x-rate-limit-reset", 0))
+        delay = min(self.max_pause, max(1.0, reset - time.time()))
+        metrics.incr("twitter.rate_limited")
+        log.info(f"twitter rate limit hit, pausing for {delay:.0f}s")
+        time.sleep(delay)
+
+    def stop(self):
+        """Stop posting once the tweets already queued are posted"""
+        if self._thread is not None:
+            self._queue.put(None)
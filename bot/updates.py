@@ -0,0 +1,131 @@
+"""
+    Updates Module
+    Decodes incoming Telegram updates once into light typed objects
+"""
+import time
+
+from .data_types import Message, User
+
+try:  # use a faster JSON decoder when one is installed
+    from orjson import loads
+except ImportError:
+    try:
+        from ujson import loads
+    except ImportError:
+        from json import loads
+
+
+class From:
+    """Sender of an incoming message"""
+
+    __slots__ = ("id", "is_bot", "first_name", "last_name", "username", "language_code")
+
+    def __init__(
+        self,
+        id: int,
+        is_bot: bool,
+        first_name: str,
+        last_name: str = None,
+        username: str = None,
+        language_code: str = "en",
+    ):
+        self.id = id
+        self.is_bot = is_bot
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.language_code = language_code
+
+    def to_user(self, chat_id: int, now: float = None) -> User:
+        """A new, active, non-admin User for this sender"""
+        now = now or time.time()
+        return User(
+            self.id,
+            self.is_bot,
+            False,
+            self.first_name,
+            self.last_name,
+            self.username,
+            self.language_code,
+            True,
+            now,
+            now,
+            None,
+            chat_id,
+        )
+
+
+class MessageIn:
+    """An incoming message"""
+
+    __slots__ = ("message_id", "sender", "chat_id", "date", "text")
+
+    def __init__(
+        self, message_id: int, sender: From, chat_id: int, date: int, text: str
+    ):
+        self.message_id = message_id
+        self.sender = sender
+        self.chat_id = chat_id
+        self.date = date
+        self.text = text
+
+    def to_message(self, update_id: int) -> Message:
+        """The Message to store for this incoming message"""
+        return Message(
+            self.message_id,
+            update_id,
+            self.sender.id,
+            self.chat_id,
+            self.date,
+            self.text,
+        )
+
+
+class Update:
+    """An incoming update, ``message`` is None for updates we don't handle"""
+
+    __slots__ = ("update_id", "message")
+
+    def __init__(self, update_id: int, message: MessageIn = None):
+        self.update_id = update_id
+        self.message = message
+
+    @property
+    def chat_id(self):
+        return self.message.chat_id if self.message else None
+
+
+def parse_update(data: dict) -> Update:
+    """Build an Update from one decoded update dict, walking it once"""
+    message = data.get("message")
+    if not message:  # e.g. edited messages
+        return Update(data["update_id"])
+    sender = message["from"]
+    return Update(
+        data["update_id"],
+        MessageIn(
+            message["message_id"],
+            From(
+                sender["id"],
+                sender.get("is_bot", False),
+                sender.get("first_name"),
+                sender.get("last_name"),
+                sender.get("username"),
+                sender.get("language_code", "en"),
+            ),
+            message["chat"]["id"],
+            message.get("date"),
+            message.get("text", ""),
+        ),
+    )
+
+
+def parse_updates(payload) -> list:
+    """Build Updates from a getUpdates response
+
+    ``payload`` is the raw JSON (bytes/str), the decoded response dict or its ``result`` list"""
+    if isinstance(payload, (bytes, str)):
+        payload = loads(payload)
+    if isinstance(payload, dict):
+        payload = payload.get("result") or []
+    return [parse_update(data) for data in payload]
@@ -65,6 +65,18 @@ def get_command_handler(command):
     return command_service.get(command)
 
 
+def get_command_limit(command):
+    """Returns how many calls of ``command`` may be queued or running at once"""
+    commands_limit = {
+        "/weather": 4,
+        "/translate": 4,
+        "/calculate": 4,
+        "/tweet": 1,
+        "/ocr_url": 2,
+    }
+    return commands_limit.get(command, 8)
+
+
 def time_in_range(start, end, x):
     """Return true if x is in the range [start, end]"""
     if start <= end:
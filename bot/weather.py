@@ -0,0 +1,68 @@
+"""
+    Weather Module
+    Serves the forecast from memory, refreshed in the background and fetched once at a time
+"""
+import threading
+import time
+
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+log = config_logger(__name__)
+
+
+class WeatherService:
+    """The latest forecast returned by ``fetch(deadline)``, which raises on failure
+
+    A forecast is fresh for ``ttl`` seconds. ``refresh`` is meant to be scheduled so
+    lookups always hit memory; a lookup of a missing/expired forecast fetches it, and
+    concurrent lookups wait for that one fetch instead of making their own. When
+    fetching fails, the last forecast is served until it's ``max_stale`` seconds old."""
+
+    def __init__(self, fetch, ttl: float = 3600.0, max_stale: float = 3 * 3600.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._cached = (None, 0.0)  # (forecast, monotonic time fetched), swapped whole
+        self._lock = threading.Lock()
+        self._in_flight = None  # Event set when the running fetch is over
+
+    def get(self, deadline=None) -> str:
+        """Returns the forecast, raises the fetch error if there's none to serve"""
+        forecast, fetched = self._cached
+        if forecast is not None and time.monotonic() - fetched < self.ttl:
+            metrics.incr("weather.hits")
+            return forecast
+        metrics.incr("weather.misses")
+        try:
+            return self.refresh(deadline)
+        except Exception as err:
+            forecast, fetched = self._cached
+            if forecast is not None and time.monotonic() - fetched < self.max_stale:
+                metrics.incr("weather.stale")
+                log.info(f"serving a stale forecast: {err}")
+                return forecast
+            raise
+
+    def refresh(self, deadline=None) -> str:
+        """Fetch the forecast now, or wait for the fetch already running"""
+        with self._lock:
+            in_flight = self._in_flight
+            if in_flight is None:
+                self._in_flight = threading.Event()
+        if in_flight is not None:  # another thread is fetching, share its result
+            metrics.incr("weather.coalesced")
+            in_flight.wait(deadline.remaining() if deadline else None)
+            forecast, fetched = self._cached
+            if forecast is None or time.monotonic() - fetched >= self.ttl:
+                raise LookupError("no fresh forecast")
+            return forecast
+        try:
+            with metrics.timer("weather.fetch"):
+                forecast = self.fetch(deadline)
+            self._cached = (forecast, time.monotonic())
+            return forecast
+        finally:
+            with self._lock:
+                self._in_flight.set()
+                self._in_flight = None
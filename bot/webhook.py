@@ -0,0 +1,116 @@
+"""
+    Webhook Module
+    A small local HTTP endpoint Telegram POSTs updates to, instead of long polling
+"""
+import hmac
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .metrics import metrics
+from .updates import loads, parse_update
+from loggingconfigs import config_logger
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+log = config_logger(__name__)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookServer:
+    """Accepts Telegram update POSTs on ``path`` and puts them on ``self.updates`` as Updates
+
+    A POST is answered once its update is ``acknowledge``d: 200 if it was handled, 500
+    if it failed or took over ``reply_timeout`` seconds, so Telegram sends it again.
+    Requests without the matching ``secret_token`` header are rejected with 403"""
+
+    def __init__(
+        self,
+        secret_token: str,
+        host: str = "0.0.0.0",
+        port: int = 8443,
+        path: str = "/webhook",
+        reply_timeout: float = 30.0,
+    ):
+        self.secret_token = secret_token
+        self.path = path
+        self.reply_timeout = reply_timeout
+        self.updates = queue.Queue()  # incoming updates, consumed by the bot loop
+        self.replies = {}  # update_id -> queue the status of its POST's reply is put on
+        self.httpd = _ThreadingHTTPServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def _handler_class(self):
+        server = self
+
+        class UpdateHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    return self._reply(404)
+                token = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token, server.secret_token):
+                    metrics.incr("webhook.rejected")
+                    return self._reply(403)
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    update = parse_update(loads(self.rfile.read(length)))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    return self._reply(400)
+                reply = server.replies[update.update_id] = queue.Queue(1)
+                server.updates.put(update)
+                metrics.incr("webhook.updates")
+                try:
+                    self._reply(reply.get(timeout=server.reply_timeout))
+                except queue.Empty:
+                    server.replies.pop(update.update_id, None)
+                    metrics.incr("webhook.timeouts")
+                    self._reply(500)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                log.debug("webhook: " + format % args)
+
+        return UpdateHandler
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="webhook", daemon=True
+        )
+        self.thread.start()
+        log.info(f"webhook listening on port {self.port}{self.path}")
+
+    def get_updates(self, timeout: float = None) -> list:
+        """Wait up to ``timeout`` seconds for an update, then drain everything queued"""
+        try:
+            batch = [self.updates.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                batch.append(self.updates.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def acknowledge(self, updates: list, handled: bool = True):
+        """Answer the POSTs of ``updates``, with 200 if they were ``handled``"""
+        for update in updates:
+            reply = self.replies.pop(update.update_id, None)
+            if reply is not None:
+                reply.put(200 if handled else 500)
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,115 @@
+"""
+    Workers Module
+    Runs slow command handlers off the update loop, on a bounded pool of threads
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import metrics
+from loggingconfigs import config_logger
+
+BUSY_MESSAGE = "I'm busy right now, try again in a moment."
+TIMEOUT_MESSAGE = "That took too long, try again later."
+ERROR_MESSAGE = "Error happened, try again later."
+log = config_logger(__name__)
+
+
+def _once(reply):
+    """Wrap ``reply`` so only its first call goes through, returns whether it did"""
+    lock = threading.Lock()
+    replied = []
+
+    def answer(text) -> bool:
+        with lock:
+            if replied:
+                return False
+            replied.append(text)
+        reply(text)
+        return True
+
+    return answer
+
+
+class CommandPool:
+    """Runs command handlers on ``workers`` threads, answering through a ``reply`` callable
+
+    At most ``queue_size`` calls wait for a free worker, and at most ``limit(command)``
+    calls of the same command are waiting or running. Calls beyond that are rejected,
+    so the caller answers "busy" instead of stalling. A call not answered ``timeout``
+    seconds after it was submitted is answered with TIMEOUT_MESSAGE, its late result
+    is dropped.
+
+    Queue depth, wait time, rejections and timeouts are in the shared metrics as
+    ``commands.*``"""
+
+    def __init__(
+        self, workers: int = 8, queue_size: int = 32, limit=None, timeout: float = 30.0
+    ):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="command")
+        self.timeout = timeout
+        self.limit = limit or (lambda command: workers)
+        self.queued = 0  # calls waiting for a worker
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._limits = {}  # command -> BoundedSemaphore
+        self._lock = threading.Lock()
+
+    def _limit_of(self, command: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if command not in self._limits:
+                self._limits[command] = threading.BoundedSemaphore(self.limit(command))
+            return self._limits[command]
+
+    def submit(self, command: str, func, args: tuple, reply) -> bool:
+        """Run ``func(*args)`` on a worker and call ``reply`` with its result
+
+        Returns False, without running anything, if the pool or command is full"""
+        limit = self._limit_of(command)
+        if not limit.acquire(blocking=False):
+            metrics.incr("commands.rejected")
+            return False
+        if not self._slots.acquire(blocking=False):
+            limit.release()
+            metrics.incr("commands.rejected")
+            return False
+        with self._lock:
+            self.queued += 1
+            metrics.gauge("commands.queued", self.queued)
+        answer = _once(reply)
+        timer = threading.Timer(self.timeout, self._time_out, (command, answer))
+        timer.daemon = True
+        timer.start()
+        self.executor.submit(
+            self._run, command, func, args, answer, limit, timer, time.monotonic()
+        )
+        return True
+
+    def _run(self, command, func, args, answer, limit, timer, submitted):
+        with self._lock:
+            self.queued -= 1
+            metrics.gauge("commands.queued", self.queued)
+        metrics.observe("commands.wait", time.monotonic() - submitted)
+        result = ERROR_MESSAGE
+        try:
+            with metrics.timer(f"commands.{command}"):
+                result = func(*args)
+        except Exception as err:  # a failing handler must not kill the worker
+            metrics.incr(f"commands.{command}.errors")
+            log.error(f"{command} failed: {err}")
+        finally:
+            timer.cancel()
+            limit.release()
+            self._slots.release()
+        try:
+            answer(result)
+        except Exception as err:
+            log.error(f"{command}: answering failed: {err}")
+
+    @staticmethod
+    def _time_out(command: str, answer):
+        if answer(TIMEOUT_MESSAGE):
+            metrics.incr("commands.timeouts")
+            log.info(f"{command} timed out")
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -51,4 +51,32 @@ CREATE TABLE IF NOT EXISTS `Announcement` (
 	"description" 	TEXT,
 	"done"			VARCHAR
 );
+CREATE TABLE IF NOT EXISTS `Conversation` (
+	`user_id`	INTEGER NOT NULL,
+	`chat_id`	INTEGER NOT NULL,
+	`command`	TEXT NOT NULL,
+	`expires`	REAL NOT NULL,
+	PRIMARY KEY(`user_id`,`chat_id`)
+);
+CREATE TABLE IF NOT EXISTS `BotState` (
+	`key`	TEXT NOT NULL,
+	`value`	INTEGER,
+	PRIMARY KEY(`key`)
+);
+CREATE TABLE IF NOT EXISTS `Outbox` (
+	`id`	INTEGER PRIMARY KEY AUTOINCREMENT,
+	`chat_id`	INTEGER NOT NULL,
+	`text`	TEXT NOT NULL,
+	`status`	TEXT NOT NULL DEFAULT 'pending',
+	`attempts`	INTEGER NOT NULL DEFAULT 0,
+	`next_attempt_at`	REAL NOT NULL,
+	`created`	REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS `Translation` (
+	`key`	TEXT NOT NULL,
+	`text`	TEXT NOT NULL,
+	`hits`	INTEGER NOT NULL DEFAULT 0,
+	`used`	REAL NOT NULL,
+	PRIMARY KEY(`key`)
+);
 COMMIT;
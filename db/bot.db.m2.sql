@@ -0,0 +1,27 @@
+BEGIN TRANSACTION;
+CREATE INDEX IF NOT EXISTS `UserActiveChat` ON `User` (`active`, `chat_id`);
+CREATE INDEX IF NOT EXISTS `ScheduleDay` ON `Schedule` (`day`);
+CREATE INDEX IF NOT EXISTS `AnnouncementDoneDue` ON `Announcement` (`done`, `due`);
+CREATE INDEX IF NOT EXISTS `OutboxDue` ON `Outbox` (`status`, `next_attempt_at`);
+CREATE INDEX IF NOT EXISTS `OutboxBroadcast` ON `Outbox` (`broadcast`);
+CREATE INDEX IF NOT EXISTS `TranslationUsed` ON `Translation` (`used`);
+CREATE TRIGGER IF NOT EXISTS `AnnouncementTimeUpdated` AFTER UPDATE OF `time` ON `Announcement`
+BEGIN
+	UPDATE `Announcement` SET `due` = NULL WHERE `id` = NEW.`id`;
+END;
+CREATE TRIGGER IF NOT EXISTS `ScheduleInserted` AFTER INSERT ON `Schedule`
+BEGIN
+	INSERT OR REPLACE INTO `BotState` VALUES ('schedule_version',
+		COALESCE((SELECT `value` FROM `BotState` WHERE `key` = 'schedule_version'), 0) + 1);
+END;
+CREATE TRIGGER IF NOT EXISTS `ScheduleUpdated` AFTER UPDATE ON `Schedule`
+BEGIN
+	INSERT OR REPLACE INTO `BotState` VALUES ('schedule_version',
+		COALESCE((SELECT `value` FROM `BotState` WHERE `key` = 'schedule_version'), 0) + 1);
+END;
+CREATE TRIGGER IF NOT EXISTS `ScheduleDeleted` AFTER DELETE ON `Schedule`
+BEGIN
+	INSERT OR REPLACE INTO `BotState` VALUES ('schedule_version',
+		COALESCE((SELECT `value` FROM `BotState` WHERE `key` = 'schedule_version'), 0) + 1);
+END;
+COMMIT;
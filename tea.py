@@ -1,9 +1,10 @@
 # --------- std/extra libraries
-import requests
+import argparse
+import asyncio
+import signal
 import time
 import os
-import urllib
-from datetime import datetime, timedelta, time as dtime, date
+from functools import partial
 
 # -------- project modules
 from bot.utils import (
@@ -11,10 +12,24 @@ from bot.utils import (
     command_takes_input,
     get_hint_message,
     get_command_handler,
-    time_in_range,
+    get_command_limit,
 )
 from bot.db import DBHelper
-from bot.data_types import Message, User
+from bot.telegram import TelegramClient
+from bot.metrics import metrics
+from bot.outbox import Outbox
+from bot.workers import CommandPool, BUSY_MESSAGE
+from bot.breaker import Deadline
+from bot.commands import weather_service, translations, ocr_jobs, tweets
+from bot.ocr import BUSY, PROCESSING, PROCESSING_MESSAGE
+from bot.webhook import WebhookServer
+from bot.conversation import ConversationStore
+from bot.dates import CAIRO, now_in_cairo
+from bot.scheduler import Scheduler
+from bot.schedule import ScheduleMessages
+from bot.announcements import announce_pending
+from bot import aio
+from bot.updates import Update, parse_updates
 from loggingconfigs import config_logger
 
 # -------- loggers setup
@@ -22,334 +37,340 @@ log = config_logger(__name__)
 bot_token = os.environ.get("BOT_TOKEN")
 if not bot_token:
     exit("Provide your telegram bot token!")
-# base url for our requests to the telegram APIs
-URL = f"https://api.telegram.org/bot{bot_token}/"
+# pooled keep-alive client for our requests to the telegram APIs
+client = TelegramClient(bot_token)
+# queues and delivers every outgoing message, set up in __main__ once the db is
+outbox = None
+# runs the commands calling external APIs without blocking the update loop
+commands = CommandPool(limit=get_command_limit)
+# seconds a command has to answer an update, before the pool's own timeout
+COMMAND_DEADLINE = 20.0
 
 
-def get_updates(offset=None):
-    """Get updates after the offset"""
-    # timeout will keep the pipe open and tell us when there"re new updates
-    url = URL + 'getUpdates?timeout=20&allowed_updates=["messages"]'
-    if offset:
-        url += f"&offset={offset}"  # add offset if exists
-        log.debug("update offset: " + str(offset))
-    return requests.get(url).json()  # return dict of latest updates
+def last_update_id(updates: list):
+    """takes list of updates and return the id of last one"""
+    log.info("listing updates to be handled...")
+    update_ids = [update.update_id for update in updates]
+    return max(update_ids)  # the last update is the higher one
 
 
-def send_message(chat_id, text):
-    """Encodes ``text`` using url-based encoding and send it to ``chat_id``"""
-    requests.get(
-        URL + f"sendMessage?chat_id={chat_id}&text={urllib.parse.quote_plus(text)}"
-    )
+# pending command of every (user, chat) conversation
+conversations = ConversationStore()
+# id of the last received update, resumed from the DB checkpoint on startup
+high_water_mark = 0
 
 
-def last_update_id(updates):
-    """takes dict of updates and return the id of last one"""
-    log.info("listing updates to be handled...")
-    update_ids = [int(update["update_id"]) for update in updates["result"]]
-    return max(update_ids)  # the last update is the higher one
+def unhandled_updates(updates: list) -> list:
+    """Drop updates at or below the high-water mark, they were handled before a restart
+    or are redeliveries (no per-message DB lookup needed)
 
+    Updates must arrive in order across calls, as getUpdates and our webhook (see
+    ``TelegramClient.set_webhook``) deliver them; each call's are sorted"""
+    global high_water_mark
+    fresh = sorted(
+        (update for update in updates if update.update_id > high_water_mark),
+        key=lambda update: update.update_id,
+    )
+    if len(fresh) < len(updates):
+        log.info("skipping " + str(len(updates) - len(fresh)) + " handled updates")
+        metrics.incr("updates.skipped", len(updates) - len(fresh))
+    if fresh:
+        high_water_mark = last_update_id(fresh)
+    return fresh
 
-current_command = None  # stores currently operating command
 
+def handle_updates(updates: list, db: DBHelper, checkpoint=last_update_id):
+    """Handles incoming ``Update``s to the bot, their DB writes are committed together
+    with the checkpoint of the last handled update
 
-def handle_updates(updates: list, db: DBHelper):
-    """Handles incoming updates to the bot"""
-    global current_command  # use current_command var from global scope
-    for update in updates:  # loop through updates
-        # db.add_message((id: int, update_id: int, user_id: int, chat_id: int, date: int(unix_timestamp), text: str))
+    ``checkpoint`` returns the update to checkpoint given the handled ones, the async
+    runtime handles updates out of order so it passes its own"""
+    with db.batch():
+        for update in updates:  # loop through updates
+            handle_update(update, db)
+        if updates:
+            db.checkpoint_update(checkpoint(updates))
+    outbox.wake()  # replies are committed, deliver them
 
-        # TODO: common message and user data from the same update
 
-        # Skip edited messages
-        if not update.get("message"):
-            continue
+def handle_update(update: Update, db: DBHelper):
+    """Handles a single incoming update"""
+    # Skip edited messages
+    if not update.message:
+        return
 
-        # getting message data
-        msg_id = update.get("message").get("message_id")  # message id
-        msg_update_id = update.get("update_id")  # update id of this message
-        msg_user_id = update.get("message").get("from").get("id")  # sending user
-        msg_chat_id = (
-            update.get("message").get("chat").get("id")
-        )  # chat id of the message
-        msg_date = update.get("message").get("date")  # message date
-        msg_text = update.get("message").get("text", "")  # message text
+    incoming = update.message
+    msg_text = incoming.text  # message text
+    user_id = incoming.sender.id  # sending user
+    # store the message, already stored messages are ignored
+    db.ingest_message(incoming.to_message(update.update_id))
+    # add new users (active, not admin), set chat_id of old users missing it
+    user = db.upsert_user(incoming.sender.to_user(incoming.chat_id))
+    log.info("saving message and user data... done")
 
-        log.info("collecting message data... done")
-        # Create Message object from incoming data
-        msg = Message(
-            msg_id, msg_update_id, msg_user_id, msg_chat_id, msg_date, msg_text
-        )
-        log.info("creating message object from collected data... done")
-        if not db.get_message(msg.id):  # if message doesn't exist already
-            db.add_message(msg)
-            log.info("New message saved.")
-
-        # db.add_user((id: int, is_bot: int, is_admin: int, first_name: str, last_name: str,
-        # username: str, language_code: str, active: int(0|1), created: int(unix_timestamp),
-        # updated: int(unix_timestamp), last_command: str))
-        user_id = update.get("message").get("from").get("id")
-        user_is_bot = update.get("message").get("from").get("is_bot")
-        user_first_name = update.get("message").get("from").get("first_name")
-        user_last_name = update.get("message").get("from").get("last_name")
-        user_username = update.get("message").get("from").get("username")
-        user_language_code = (
-            update.get("message").get("from").get("language_code", "en")
-        )
-        user_created = time.time()
-        user_updated = time.time()
-        user_last_command = None
-        user_chat_id = update.get("message").get("chat").get("id")
-        log.info("collecting user data... done")
-        # if user doesn't exist, add him/her to db
-        if not db.get_user(user_id):
-            user_is_admin = False
-            user_active = True
-            user = User(
-                user_id,
-                user_is_bot,
-                user_is_admin,
-                user_first_name,
-                user_last_name,
-                user_username,
-                user_language_code,
-                user_active,
-                user_created,
-                user_updated,
-                user_last_command,
-                user_chat_id,
-            )
-            db.add_user(user)
-            log.info("New user saved.")
-
-        log.info("Old user..")
-        # Create user object from saved data
-        user = db.get_user(user_id)
-        if not user.chat_id:
-            log.info("User does't have a chat_id yet!")
-            db.set_user_chat_id(user.id, time.time(), user_chat_id)
-            log.info("Updated user's chat_id")
-            # get user again after updating chat_id
-            user = db.get_user(user_id)
-        log.info("creating user object from collected data... done")
-
-        user_last_command = user.last_command
-        text = None  # msg text
-        chat = msg_chat_id  # chat id
-        log.debug("user: " + str(user_id) + " sent a message - chat_id: " + str(chat))
-        if msg_text:  # handle text messages only
-            text = msg_text.strip()  # extract msg text
-            if text and chat:  # make sure we have txt msg and chat_id
-                log.info("text message and chat_id are  extracted.")
-                if text.startswith("/"):  # if command
-                    if is_available_command(text):  # if command is available
-                        current_command = text  # set current command
-                        log.info('command: "' + current_command + '" is available.')
-                        db.set_user_last_command(
-                            user.id, time.time(), current_command
-                        )  # update user's last command
-                        if command_takes_input(
-                            current_command
-                        ):  # if command operates on inputs
-                            hint_message = get_hint_message(
-                                current_command
-                            )  # get command hint message
-                            send_message(
-                                chat, hint_message
-                            )  # send a help message to receive inputs later
-                            log.info("sending hint message to user... done")
-                        else:  # if command is available and does not operate on inputs
-                            log.info(
-                                'command: "' + current_command + '" has no argument.'
+    text = None  # msg text
+    chat = incoming.chat_id  # chat id
+    log.debug("user: " + str(user_id) + " sent a message - chat_id: " + str(chat))
+    if msg_text:  # handle text messages only
+        text = msg_text.strip()  # extract msg text
+        if text and chat:  # make sure we have txt msg and chat_id
+            log.info("text message and chat_id are  extracted.")
+            if text.startswith("/"):  # if command
+                if is_available_command(text):  # if command is available
+                    command = text  # set current command
+                    log.info('command: "' + command + '" is available.')
+                    # remember the command of this conversation
+                    conversations.set(user.id, chat, command)
+                    if command_takes_input(command):  # if command operates on inputs
+                        hint_message = get_hint_message(
+                            command
+                        )  # get command hint message
+                        outbox.send(
+                            chat, hint_message
+                        )  # send a help message to receive inputs later
+                        log.info("sending hint message to user... done")
+                    else:  # if command is available and does not operate on inputs
+                        log.info('command: "' + command + '" has no argument.')
+                        # execute command directly
+                        if command == "/stop":
+                            get_command_handler(command)(
+                                db, user_id, time.time(), False
                             )
-                            # execute command directly
-                            if current_command == "/stop":
-                                get_command_handler(current_command)(
-                                    db, user_id, time.time(), False
-                                )
-                                current_command = None
-                            elif current_command == "/start":
-                                get_command_handler(current_command)(
-                                    db, user_id, time.time(), True
-                                )
-                                current_command = None
-                            else:
-                                send_message(
-                                    chat, get_command_handler(current_command)()
-                                )
-                                # then unset current_command, commands_without_args execute once!
-                                current_command = None
-                                log.info("updating user current command.. one time cmd")
-                                db.set_user_last_command(
-                                    user.id, time.time(), current_command
-                                )
-
-                    else:  # if command is not available
-                        log.info("Undefined Command")
-                        send_message(chat, "Use a defined command.")
-                else:  # if sent message does not start with a slash
-                    log.info(
-                        "working on user's last command.. " + str(user.last_command)
-                    )
-                    last_command = user.last_command
-                    if command_takes_input(
-                        last_command
-                    ):  # should be an argument if current_command is set
-                        log.info("received command arguments from user...")
-                        send_message(chat, get_command_handler(last_command)(text))
-                        log.info("sending message to user... done")
-                    elif current_command in ["/start", "/stop"]:
-                        continue  # skip
-                    else:
-                        log.info("Undefined Command.")
-                        send_message(chat, "Use a defined command.")
-        else:  # if no text message
-            log.debug(
-                "A non text message is sent by user: "
-                + str(user_id)
-                + " - chat id: "
-                + str(chat)
-            )
-            send_message(chat, "I handle text messages only!")
+                        elif command == "/start":
+                            get_command_handler(command)(db, user_id, time.time(), True)
+                        else:
+                            run_command(chat, command)
+                        # then unset the command, commands_without_args execute once!
+                        log.info("clearing user current command.. one time cmd")
+                        conversations.clear(user.id, chat)
+
+                else:  # if command is not available
+                    log.info("Undefined Command")
+                    outbox.send(chat, "Use a defined command.")
+            else:  # if sent message does not start with a slash
+                # the pending command of this conversation, if any
+                last_command = conversations.get(user.id, chat)
+                log.info("working on user's last command.. " + str(last_command))
+                if command_takes_input(
+                    last_command
+                ):  # should be an argument if a command is pending
+                    log.info("received command arguments from user...")
+                    run_command(chat, last_command, text)
+                    log.info("sending message to user... done")
+                else:
+                    log.info("Undefined Command.")
+                    outbox.send(chat, "Use a defined command.")
+    else:  # if no text message
+        log.debug(
+            "A non text message is sent by user: "
+            + str(user_id)
+            + " - chat id: "
+            + str(chat)
+        )
+        outbox.send(chat, "I handle text messages only!")
+
+
+def run_command(chat: int, command: str, *args):
+    """Answer ``command`` in ``chat`` from the command pool, or tell the user we're busy
+
+    /ocr_url is answered "processing" at once and with the text when the OCR job is done"""
+    if command == "/ocr_url":
+        status = ocr_jobs.submit(args[0], partial(outbox.send, chat))
+        if status == PROCESSING:
+            outbox.send(chat, PROCESSING_MESSAGE)
+        elif status == BUSY:
+            log.info(f"too busy to run {command} in chat {chat}")
+            outbox.send(chat, BUSY_MESSAGE)
+        return
+    handler = partial(get_command_handler(command), deadline=Deadline(COMMAND_DEADLINE))
+    if not commands.submit(command, handler, args, partial(outbox.send, chat)):
+        log.info(f"too busy to run {command} in chat {chat}")
+        outbox.send(chat, BUSY_MESSAGE)
+
+
+WEEKDAYS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+
+def send_schedule(db: DBHelper):
+    """Broadcast today's schedule"""
+    today = WEEKDAYS[now_in_cairo().weekday()]  # What is today?
+    outbox.broadcast(schedule_messages.message_of(today))
+    log.info(f"Sending today's schedule of {today}")
+
+
+def send_announcements(db: DBHelper):
+    """Broadcast new, cancelled, and due-tomorrow announcements"""
+    announce_pending(db, outbox, now_in_cairo())
+
+
+def purge_outbox(db: DBHelper):
+    """Forget messages delivered (or given up on) over a week ago"""
+    db.purge_outbox(time.time() - 7 * 24 * 3600)
+
+
+def refresh_weather(db: DBHelper):
+    """Prefetch the forecast so /weather answers from memory"""
+    weather_service.refresh(Deadline(COMMAND_DEADLINE))
+
+
+# (name, cron spec "minute hour day month weekday", job) of the timed jobs
+JOBS = (
+    ("schedule", "0 8 * * 6,0,1,2,3", send_schedule),  # 8:00AM, Saturday to Wednesday
+    ("announcements", "16 20 * * *", send_announcements),
+    ("purge-outbox", "30 3 * * *", purge_outbox),
+    ("weather", "*/30 * * * *", refresh_weather),
+)
+
+
+schedule_messages = None  # cached schedule message of every day, see start_scheduler
+
+
+def start_scheduler(db: DBHelper) -> Scheduler:
+    """Schedule ``JOBS`` on Cairo time and start running them"""
+    global schedule_messages
+    schedule_messages = ScheduleMessages(db)
+    scheduler = Scheduler(db)
+    for name, spec, job in JOBS:
+        scheduler.add(name, spec, CAIRO, partial(job, db))
+    scheduler.start()
+    return scheduler
+
+
+scheduler = None  # runs JOBS, see start_scheduler
+
+
+def shutdown(db: DBHelper):
+    """Release resources and flush pending DB writes before exiting"""
+    log.info("\nquiting...")
+    log.info("metrics: " + str(metrics.snapshot()))
+    log.info("translation memory: " + str(translations.stats()))
+    if scheduler:
+        scheduler.stop()
+    commands.shutdown(wait=False)
+    ocr_jobs.shutdown(wait=False)
+    tweets.stop()
+    outbox.stop(wait=False)
+    client.close()
+    conversations.stop_snapshots()
+    conversations.snapshot(db)
+    db.close()
+
+
+def terminate(signum, frame):
+    """Turn SIGTERM (e.g. a Heroku dyno restart) into a clean Ctrl-C shutdown"""
+    raise KeyboardInterrupt
 
 
 def main(db: DBHelper):
     """The entry point"""
-    updates_offset = None  # track last_update_id to use it as offset
+    client.delete_webhook()  # getUpdates doesn't work while a webhook is set
+    updates_offset = high_water_mark + 1  # resume after the last handled update
     while True:  # infinitely listen to new updates (as long as the script is running)
         try:
-            # =============================== Handling Schedule ==============================================
-            # Order  =     0           1          2            3         4          5          6
-            weekdays = (
-                "monday",
-                "tuesday",
-                "wednesday",
-                "thursday",
-                "friday",
-                "saturday",
-                "sunday",
-            )
-            study_days = (5, 6, 0, 1, 2)
-            today = datetime.today().weekday()  # What is today?
-            now_in_egypt = str(
-                format(datetime.utcnow() + timedelta(hours=2), "%H:%M:%S")
-            )  # Cairo time = UTC+2
-            now_in_egypt = dtime(
-                *[int(x) for x in now_in_egypt.split(":")]
-            )  # to datetime.time object
-            before_eight = dtime(7, 59, 45)  # get before 8:00AM with 5 seconds
-            after_eight = dtime(8, 0, 15)  # get after 8:00AM with 5 seconds
-
-            # if it's in range (07:59:55 |08:00| 08:00:05) in the morning
-            if (
-                time_in_range(before_eight, after_eight, now_in_egypt)
-                and today in study_days
-            ):
-                schedule = db.get_schedule_of(
-                    weekdays[today]
-                )  # get schedule of today
-                # ================== formating the message to send
-                msg_schedule_part = ""
-                for idx, entry in enumerate(schedule):
-                    msg_schedule_part += (
-                        str(idx + 1) + ". " + entry[1] + " at " + entry[0] + "\n"
-                    )
-                msg = (
-                    "Good morning, \n"
-                    "today is {0} and the schedule is: \n\n"
-                    "{1}".format(weekdays[today].title(), msg_schedule_part)
-                )
-                users = db.get_users()  # get list of all users
-                for user in users:
-                    if user.active:
-                        log.info(f"Sending today's schedule to: {user}")
-                        send_message(user.chat_id, msg)  # send today's schedule
-                        time.sleep(
-                            0.5
-                        )  # sleep for .5 second before sending to the next user
-
-            # =============================== Handling Announcements =========================================
-            before_seven = dtime(6, 59, 45)  # get before 7:00AM with 5 seconds
-            after_seven = dtime(7, 0, 15)  # get after 7:00AM with 5 seconds
-            before_seven = dtime(20, 16, 0)  # get before 7:00AM with 5 seconds
-            after_seven = dtime(20, 17, 0)  # get after 7:00AM with 5 seconds
-            if time_in_range(before_seven, after_seven, now_in_egypt):
-                anns = db.get_announcements()
-                for ann in anns:
-                    if ann.done == "" or ann.done is None:
-                        users = db.get_users()  # get list of all users
-                        for user in users:
-                            if user.active:
-                                log.info(
-                                    f"Sending announcement: {ann} schedule to: {user}"
-                                )
-                                send_message(user.chat_id, ann.description)
-                                time.sleep(
-                                    0.5
-                                )  # sleep for .5 second before sending to the next user
-                        db.update_announcement(ann.id, "once")
-                    elif ann.done == "cancelled":
-                        users = db.get_users()  # get list of all users
-                        for user in users:
-                            if user.active:
-                                log.info(
-                                    f"Sending cancelled announcement: {ann} schedule to: {user}"
-                                )
-                                send_message(
-                                    user.chat_id, ann.description + " IS CANCELLED"
-                                )
-                                time.sleep(
-                                    0.5
-                                )  # sleep for .5 second before sending to the next user
-                        db.update_announcement(ann.id, "twice")
-                    else:  # if ann.done=="once"
-                        list_ann_time = ann.time.split(" ")
-                        ann_time_day = int(list_ann_time[0].split("-")[0])
-                        ann_time_month = int(list_ann_time[0].split("-")[1])
-                        ann_day = date(
-                            datetime.today().year, ann_time_month, ann_time_day
-                        )
-                        today = datetime.today().date()
-                        if (ann_day - today).days == 1:
-                            for user in users:
-                                if user.active:
-                                    log.info(
-                                        f"Sending announcement (done=once): {ann} schedule to: {user}"
-                                    )
-                                    send_message(
-                                        user.chat_id, ann.description + " TOMORROW"
-                                    )
-                                    time.sleep(
-                                        0.5
-                                    )  # sleep for .5 second before sending to the next user
-                            db.update_announcement(ann.id, "twice")
             # =============================== Handling incoming messages =====================================
             log.info("getting updates...")
-            updates = get_updates(
-                updates_offset
-            )  # get new updates after last handled one
-            if "result" in updates:  # to prevent KeyError exception
-                if (
-                    len(updates["result"]) > 0
-                ):  # make sure updates list is longer than 0
-                    updates_offset = (
-                        last_update_id(updates) + 1
-                    )  # to remove handled updates
-                    handle_updates(
-                        updates["result"], db
-                    )  # handle new (unhandled) updates
-                else:
-                    log.info("no updates to be handled")
+            updates = unhandled_updates(
+                parse_updates(client.get_updates(updates_offset))
+            )  # get new updates after last handled one, decoded once
+            if updates:  # make sure updates list is longer than 0
+                updates_offset = (
+                    last_update_id(updates) + 1
+                )  # to remove handled updates
+                handle_updates(updates, db)  # handle new (unhandled) updates
+            else:
+                log.info("no updates to be handled")
 
             time.sleep(0.5)  # delay the loop a .5 second
         except KeyboardInterrupt:  # exit on Ctrl-C
-            log.info("\nquiting...")
+            shutdown(db)
+            exit(0)
+
+
+def webhook_main(db: DBHelper):
+    """The entry point of webhook mode, updates are pushed to our HTTP server"""
+    webhook_url = os.environ.get("WEBHOOK_URL")
+    secret_token = os.environ.get("WEBHOOK_SECRET")
+    if not (webhook_url and secret_token):
+        exit("Provide WEBHOOK_URL and WEBHOOK_SECRET to run in webhook mode!")
+    server = WebhookServer(secret_token, port=int(os.environ.get("PORT", 8443)))
+    server.start()
+    response = client.set_webhook(webhook_url, secret_token)
+    if not response.get("ok"):
+        log.error("setting the webhook failed: " + str(response.get("description")))
+        server.stop()
+        shutdown(db)
+        exit(1)
+    while True:
+        try:
+            # wake up at least every second, redelivered updates are skipped
+            received = server.get_updates(timeout=1.0)
+            handled = False
+            try:
+                updates = unhandled_updates(received)
+                if updates:
+                    handle_updates(updates, db)
+                handled = True
+            finally:  # reply to Telegram once the updates are committed
+                server.acknowledge(received, handled)
+        except KeyboardInterrupt:  # exit on Ctrl-C
+            server.stop()
+            shutdown(db)
             exit(0)
 
 
+def async_main(db: DBHelper):
+    """The entry point of the asyncio runtime (``--async``)"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(
+            aio.run(client, partial(handle_updates, db=db), offset=high_water_mark + 1,)
+        )
+    except KeyboardInterrupt:  # exit on Ctrl-C
+        shutdown(db)
+    finally:
+        loop.close()
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TBot telegram bot")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="handle chats concurrently on an asyncio event loop",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["polling", "webhook"],
+        default=os.environ.get("BOT_MODE", "polling"),
+        help="how updates are received (default: $BOT_MODE or polling)",
+    )
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, terminate)
     # Setting DB
     db = DBHelper()
     db.setup()
+    conversations.restore(db)
+    high_water_mark = db.get_update_checkpoint()
+    log.info("resuming after update: " + str(high_water_mark))
+    conversations.start_snapshots(db)
+    translations.connect(db)
+    outbox = Outbox(db, client)
+    outbox.start()
+    scheduler = start_scheduler(db)
     log.info("Running bot...")
-    main(db)
+    if args.mode == "webhook":
+        webhook_main(db)
+    elif args.use_async:
+        async_main(db)
+    else:
+        main(db)
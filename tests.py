@@ -1,11 +1,40 @@
 import unittest
+import asyncio
+import json
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
+from datetime import datetime
 from pathlib import Path
+from unittest import mock
+from urllib import request, error
 
-from bot.commands import calculate, translate
+from bot.commands import calculate, translate, weather, api_request, BREAKERS
+from bot.commands import check_public_url
+from bot.weather import WeatherService
+from bot.translation import TranslationMemory, normalize
+from bot.calculator import Calculator, TooComplex, Unsupported
+from bot.breaker import CircuitBreaker, CircuitOpen, Deadline, DeadlineExceeded
 from bot.db import DBHelper
 from bot.data_types import Message, User, ScheduleEntry, Announcement
+from bot.telegram import TelegramClient
+from bot.cache import LRUCache
+from bot.conversation import ConversationStore
+from bot.dates import CAIRO, parse_announcement_due
+from bot.metrics import metrics
+from bot.ratelimit import TokenBucket
+from bot.outbox import Outbox, split_message
+from bot.ocr import OcrQueue, BUSY, DONE, PROCESSING
+from bot.twitter import TweetQueue, DuplicateTweet, NotConfigured, TweepError
+from bot.workers import CommandPool, TIMEOUT_MESSAGE
+from bot.aio import ChatDispatcher
+from bot.updates import From, Update, MessageIn, parse_updates
+from bot.webhook import WebhookServer, SECRET_HEADER
+from bot.scheduler import CronSpec, Scheduler
+from bot.schedule import ScheduleMessages
+from bot.announcements import announce_pending
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 DB_SQL_SCRIPT = os.path.join(BASE_DIR, "db", "bot.db.m1.sql")
@@ -186,6 +215,31 @@ class DBHelperTest(unittest.TestCase):
         self.assertTrue(isinstance(got_users[1], User))
         self.assertTrue(isinstance(got_users[2], User))
 
+    def test_iter_users_streams_in_chunks(self):
+        self.db.chunk_size = 2
+        with self.db.batch():
+            for i in range(1, 6):
+                self.db.add_user(
+                    User(i, 0, 0, "A", None, f"u{i}", "en", 1, 1, 1, None, i)
+                )
+        users = self.db.iter_users()
+        self.assertTrue(isinstance(next(users), User))
+        self.assertEqual(len(list(users)), 4)
+        self.assertEqual(self.db._readers.qsize(), 4)  # reader returned to the pool
+        self.assertEqual(len(list(self.db.iter_schedule())), 14)
+        self.assertEqual(list(self.db.iter_announcements()), [])
+
+    def test_data_types_are_compact(self):
+        for obj in (
+            User(1, 0, 0, "A", None, "a", "en", 1, 1, 1, None, 1),
+            Message(1, 2, 3, 4, 5, "message"),
+            Announcement("08:30", "text", ""),
+            ScheduleEntry("08:30", "DSP Lecture", "saturday"),
+        ):
+            self.assertFalse(hasattr(obj, "__dict__"))
+        entry = self.db.get_schedule()[0]
+        self.assertEqual((entry.id, entry.day), (1, "saturday"))
+
     def test_set_user_last_command(self):
         # create a user in db with tested functions
         user = User(
@@ -258,6 +312,241 @@ class DBHelperTest(unittest.TestCase):
         got_user = self.db.get_user(user.id)
         self.assertEqual(got_user.chat_id, new_chat_id)
 
+    def test_batch_commits_writes_together(self):
+        other = sqlite3.connect(self.db.db_file)  # sees committed data only
+        with self.db.batch():
+            for i in range(1, 4):
+                self.db.add_message(Message(i, i, 3, 4, 5, "message"))
+            self.assertEqual(len(self.db._pending), 3)
+            self.assertTrue(self.db.get_message(2))  # reads see held writes
+            self.assertEqual(
+                other.execute("SELECT COUNT(*) FROM Message").fetchone()[0], 0
+            )
+        self.assertFalse(self.db._pending)
+        self.assertEqual(other.execute("SELECT COUNT(*) FROM Message").fetchone()[0], 3)
+        other.close()
+
+    def test_batch_is_not_committed_by_other_threads(self):
+        other = sqlite3.connect(self.db.db_file)  # sees committed data only
+        counts = "SELECT (SELECT COUNT(*) FROM Message), (SELECT COUNT(*) FROM Outbox)"
+        with self.db.batch():
+            self.db.ingest_message(Message(1, 1, 3, 4, 5, "message"))
+            self.db.enqueue_messages([(4, "reply")])
+            self.assertTrue(self.db.get_message(1))  # held writes are now executed
+            sender = threading.Thread(target=self.db.record_deliveries, args=([9],))
+            sender.start()
+            sender.join(0.2)  # waits for the batch to commit
+            self.assertEqual(other.execute(counts).fetchone(), (0, 0))
+        sender.join()
+        self.assertEqual(other.execute(counts).fetchone(), (1, 1))
+        other.close()
+
+    def test_update_announcement_waits_for_the_batch(self):
+        self.db.add_announcement(Announcement("11-05 10:00", "exam", ""))
+        other = sqlite3.connect(self.db.db_file)  # sees committed data only
+        with self.db.batch():
+            self.db.add_message(Message(1, 1, 3, 4, 5, "message"))
+            self.db.update_announcement(1, "once")
+            self.assertEqual(
+                other.execute("SELECT COUNT(*) FROM Message").fetchone()[0], 0
+            )
+        self.assertEqual(
+            other.execute("SELECT done FROM Announcement").fetchone()[0], "once"
+        )
+        other.close()
+
+    def test_batch_rolls_back_when_interrupted(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with self.db.batch():
+                self.db.add_message(Message(1, 1, 3, 4, 5, "message"))
+                self.assertTrue(self.db.get_message(1))
+                self.db.checkpoint_update(1)
+                raise KeyboardInterrupt  # e.g. SIGTERM, see tea.terminate
+        self.assertFalse(self.db._pending)
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertFalse(self.db.get_message(1))
+        self.assertEqual(self.db.get_update_checkpoint(), 0)
+
+    def test_batch_flushes_at_flush_size(self):
+        self.db.flush_size = 2
+        with self.db.batch():
+            self.db.add_message(Message(1, 1, 3, 4, 5, "message"))
+            self.db.add_message(Message(2, 2, 3, 4, 5, "message"))
+            self.assertFalse(self.db._pending)
+            self.assertFalse(self.db.conn.in_transaction)
+
+    def test_ingest_message_ignores_duplicates(self):
+        msg = Message(1, 2, 3, 4, 5, "message")
+        self.assertTrue(self.db.ingest_message(msg))
+        self.assertTrue(self.db.ingest_message(Message(1, 2, 3, 4, 5, "replayed")))
+        self.assertEqual(self.db.get_message(1).text, "message")
+
+    def test_update_checkpoint_commits_with_batch(self):
+        self.assertEqual(self.db.get_update_checkpoint(), 0)
+        other = sqlite3.connect(self.db.db_file)  # sees committed data only
+        with self.db.batch():
+            self.db.ingest_message(Message(1, 10, 3, 4, 5, "message"))
+            self.db.checkpoint_update(10)
+            self.assertIsNone(other.execute("SELECT value FROM BotState").fetchone())
+        self.assertEqual(other.execute("SELECT value FROM BotState").fetchone()[0], 10)
+        other.close()
+        self.db.checkpoint_update(9)  # an older update never moves it back
+        self.assertEqual(self.db.get_update_checkpoint(), 10)
+
+    def test_upsert_user(self):
+        user = User(
+            7043739, False, False, "Ahme", None, "ash75", "en", True, 1, 1, None, None
+        )
+        got_user = self.db.upsert_user(user)
+        self.assertTrue(isinstance(got_user, User))
+        self.assertEqual(got_user.chat_id, None)
+        self.db.set_user_last_command(user.id, 2, "/calculate")
+        # old user: keeps saved data, gets the missing chat_id
+        user.chat_id = 5554
+        user.updated = 3
+        got_user = self.db.upsert_user(user)
+        self.assertEqual(got_user.last_command, "/calculate")
+        self.assertEqual((got_user.chat_id, got_user.updated), (5554, 3))
+        # chat_id is only set once
+        user.chat_id = 1111
+        self.assertEqual(self.db.upsert_user(user).chat_id, 5554)
+
+    def test_user_cache(self):
+        user = User(
+            7043739, False, False, "Ahme", None, "ash75", "en", True, 1, 1, None, 5
+        )
+        self.db.add_user(user)
+        self.db.get_user(user.id)  # miss, loads the user
+        cached = self.db.get_user(user.id)
+        self.assertEqual(self.db.user_cache.stats()["hits"], 1)
+        # writes go through to the cached user
+        self.db.set_user_last_command(user.id, 2, "/translate")
+        self.db.set_user_status(user.id, 3, False)
+        self.assertIs(self.db.get_user(user.id), cached)
+        self.assertEqual((cached.last_command, cached.active), ("/translate", False))
+        # cached users with a chat_id are returned without touching the DB
+        self.assertIs(self.db.upsert_user(user), cached)
+
+    def test_lru_cache_evicts_and_expires(self):
+        cache = LRUCache("test", maxsize=2, ttl=0.05)
+        cache.put(1, "a")
+        cache.put(2, "b")
+        cache.get(1)
+        cache.put(3, "c")  # evicts 2, the least recently used
+        self.assertEqual((cache.get(1), cache.get(2), cache.get(3)), ("a", None, "c"))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(1))
+
+    def test_conversation_snapshot_and_restore(self):
+        store = ConversationStore(ttl=60)
+        store.set(1, 10, "/translate")
+        store.set(2, 20, "/calculate")
+        self.assertEqual(store.snapshot(self.db), 2)
+        restored = ConversationStore()
+        self.assertEqual(restored.restore(self.db), 2)
+        self.assertEqual(restored.get(1, 10), "/translate")
+        self.assertEqual(restored.get(2, 20), "/calculate")
+
+    def test_wal_and_reader_pool(self):
+        mode = self.db.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+        self.db.add_message(Message(1, 2, 3, 4, 5, "committed"))
+        with self.db.writer() as conn:  # an open write doesn't block pooled readers
+            conn.execute("INSERT INTO Message VALUES (2, 3, 3, 4, 5, 'open')")
+            results = []
+            thread = threading.Thread(
+                target=lambda: results.append(self.db.get_users() == [])
+            )
+            thread.start()
+            thread.join(2)
+            self.assertEqual(results, [True])
+            conn.commit()
+        with self.db.reader() as conn:
+            self.assertIsNot(conn, self.db.conn)
+            self.assertEqual(
+                conn.execute("SELECT COUNT(*) FROM Message").fetchone()[0], 2
+            )
+        self.assertIn("db.reader.wait", metrics.snapshot()["timers"])
+
+    def test_pending_announcements(self):
+        now = datetime(2019, 5, 10, 7, 0, tzinfo=CAIRO)
+        self.db.add_announcement(Announcement("11-05 10:00", "new", ""))
+        self.db.add_announcement(Announcement("11-05 10:00", "tomorrow", "once"))
+        self.db.add_announcement(Announcement("20-05 10:00", "later", "once"))
+        self.db.add_announcement(Announcement("11-05 10:00", "off", "cancelled"))
+        self.db.add_announcement(Announcement("11-05 10:00", "done", "twice"))
+        # due dates are parsed in the current year
+        self.db.cur.execute(
+            "UPDATE Announcement SET due = ? WHERE time = '11-05 10:00'",
+            (parse_announcement_due("11-05", 2019),),
+        )
+        pending = self.db.pending_announcements(now)
+        self.assertEqual(
+            [ann.description for ann in pending], ["new", "tomorrow", "off"]
+        )
+
+    def test_announcements_written_by_hand_get_due_dates(self):
+        now = datetime(2019, 5, 10, 7, 0, tzinfo=CAIRO)
+        sql = "INSERT INTO Announcement (time, description, done) VALUES (?, ?, ?)"
+        self.db.cur.execute(sql, ("11-05 10:00", "tomorrow", "once"))
+        self.db.cur.execute(sql, ("20-05 10:00", "moved", "once"))
+        self.db.conn.commit()
+        self.assertEqual(
+            [ann.description for ann in self.db.pending_announcements(now)],
+            ["tomorrow"],
+        )
+        self.db.cur.execute(  # edited by hand: the due date follows the time
+            "UPDATE Announcement SET time = '11-05 18:00' WHERE description = 'moved'"
+        )
+        self.db.conn.commit()
+        self.assertEqual(
+            [ann.description for ann in self.db.pending_announcements(now)],
+            ["tomorrow", "moved"],
+        )
+
+    def test_announcements_due_next_year(self):
+        now = datetime(2019, 12, 28, 7, 0, tzinfo=CAIRO)
+        with mock.patch("bot.dates.now_in_cairo", return_value=now):
+            self.db.add_announcement(Announcement("01-03 10:00", "next term", ""))
+            self.assertEqual(
+                parse_announcement_due("27-12"), parse_announcement_due("27-12", 2019)
+            )
+        self.assertEqual(
+            [ann.description for ann in self.db.pending_announcements(now)],
+            ["next term"],
+        )
+
+    def test_announce_pending(self):
+        now = datetime(2019, 5, 10, 7, 0, tzinfo=CAIRO)
+        self.db.add_announcement(Announcement("11-05 10:00", "exam", ""))
+        self.db.add_announcement(Announcement("09-05 10:00", "past", ""))
+        self.db.add_announcement(Announcement("11-05 10:00", "trip", "cancelled"))
+        self.db.cur.execute(
+            "UPDATE Announcement SET due = ? WHERE time = '11-05 10:00'",
+            (parse_announcement_due("11-05", 2019),),
+        )
+        self.db.cur.execute(
+            "UPDATE Announcement SET due = ? WHERE time = '09-05 10:00'",
+            (parse_announcement_due("09-05", 2019),),
+        )
+        self.db.add_user(
+            User(1, False, False, "A", None, "a", "en", True, 1, 1, None, 11)
+        )
+        client = FakeClient()
+        outbox = Outbox(self.db, client, global_rate=1000, per_chat_rate=1000)
+        self.assertEqual(announce_pending(self.db, outbox, now), 2)
+        self.assertEqual(
+            [ann.done for ann in self.db.get_announcements()], ["once", "", "twice"]
+        )
+        self.assertEqual(announce_pending(self.db, outbox, now), 1)  # due tomorrow
+        self.assertEqual(announce_pending(self.db, outbox, now), 0)
+        wait(outbox.deliver_due())
+        self.assertEqual(
+            client.sent,
+            [(11, "exam"), (11, "trip IS CANCELLED"), (11, "exam TOMORROW")],
+        )
+        outbox.stop()
+
     def test_get_schedule(self):
         # get entries
         entries_list = self.db.get_schedule()
@@ -280,6 +569,18 @@ class DBHelperTest(unittest.TestCase):
         self.assertTrue(isinstance(schedule[2], tuple))
         print("=++Schedule++= ", schedule)
 
+    def test_schedule_messages(self):
+        messages = ScheduleMessages(self.db)
+        saturday = messages.message_of("saturday")
+        # sorted by time
+        self.assertLess(saturday.index("08:30"), saturday.index("10:10"))
+        self.assertLess(saturday.index("10:10"), saturday.index("12:30"))
+        self.assertIs(messages.message_of("saturday"), saturday)  # cached
+        self.db.cur.execute("UPDATE Schedule SET subject = 'Labs' WHERE id = 3")
+        self.db.conn.commit()
+        self.assertIn("1. Labs at 08:30", messages.message_of("saturday"))
+        self.assertIn("schedule is: \n\n", messages.message_of("friday"))
+
     def test_add_announcement(self):
         # add announcement
         ann = Announcement(
@@ -337,6 +638,723 @@ class DBHelperTest(unittest.TestCase):
         self.assertEqual(ann_updated.done, "once")  # test updated value
 
 
+class TelegramClientTest(unittest.TestCase):
+    def test_send_message_posts_json(self):
+        client = TelegramClient("TOKEN")
+        response = mock.Mock()
+        response.content = b'{"ok": true, "result": {}}'
+        with mock.patch.object(client.session, "post", return_value=response) as post:
+            self.assertTrue(client.send_message(42, "hi & bye")["ok"])
+        url = post.call_args[0][0]
+        self.assertTrue(url.endswith("/botTOKEN/sendMessage"))
+        self.assertEqual(post.call_args[1]["json"], {"chat_id": 42, "text": "hi & bye"})
+        self.assertEqual(post.call_args[1]["timeout"], (5.0, 10.0))
+        self.assertGreater(
+            metrics.snapshot()["timers"]["telegram.sendMessage"]["count"], 0
+        )
+        client.close()
+
+
+class TeaTest(unittest.TestCase):
+    """The update path of tea.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        global tea
+        with mock.patch.dict(os.environ, {"BOT_TOKEN": "TOKEN"}):
+            import tea
+
+    def setUp(self):
+        tea.high_water_mark = 10
+
+    def test_skips_handled_updates_in_order(self):
+        updates = [Update(13), Update(9), Update(10), Update(11)]
+        self.assertEqual(
+            [update.update_id for update in tea.unhandled_updates(updates)], [11, 13]
+        )
+        self.assertEqual(tea.high_water_mark, 13)
+        self.assertEqual(tea.unhandled_updates([Update(12), Update(13)]), [])
+
+    def test_webhook_mode_exits_if_the_webhook_is_not_set(self):
+        env = {"WEBHOOK_URL": "https://bot.example/webhook", "WEBHOOK_SECRET": "s3"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            tea, "WebhookServer"
+        ) as server, mock.patch.object(tea, "client") as client, mock.patch.object(
+            tea, "shutdown"
+        ) as shutdown:
+            client.set_webhook.return_value = {"ok": False, "description": "bad url"}
+            self.assertRaises(SystemExit, tea.webhook_main, None)
+        server.return_value.stop.assert_called_once_with()
+        shutdown.assert_called_once_with(None)
+
+    def test_start_and_stop_do_not_swallow_later_texts(self):
+        db = DBHelper(filename="test.db")
+        db.setup()
+        sender = From(7, False, "A")
+        with mock.patch.object(tea, "outbox") as outbox:
+            for update_id, text in enumerate(["/start", "hello", "/stop", "hi"]):
+                message = MessageIn(update_id, sender, 70, 1, text)
+                tea.handle_update(Update(update_id, message), db)
+        self.assertEqual(
+            outbox.send.call_args_list, [mock.call(70, "Use a defined command.")] * 2,
+        )
+        self.assertIsNone(tea.conversations.get(7, 70))
+        db.destroy()
+
+    def test_webhook_delivers_updates_in_order(self):
+        with mock.patch.object(tea.client, "call") as call:
+            tea.client.set_webhook("https://example.com/hook", "secret")
+        self.assertEqual(call.call_args[0][1]["max_connections"], 1)
+
+
+class FakeClient:
+    """Records sent messages, answers 429 for chats listed in ``throttled`` once"""
+
+    def __init__(self, throttled=()):
+        self.sent = []
+        self.throttled = set(throttled)
+
+    def send_message(self, chat_id, text):
+        if chat_id in self.throttled:
+            self.throttled.discard(chat_id)
+            return {"ok": False, "error_code": 429, "parameters": {"retry_after": 0}}
+        self.sent.append((chat_id, text))
+        return {"ok": True}
+
+
+class RateLimitTest(unittest.TestCase):
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class FlakyClient(FakeClient):
+    """Answers the given error responses first, then delivers like FakeClient"""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def send_message(self, chat_id, text):
+        if self.errors:
+            return self.errors.pop(0)
+        return super().send_message(chat_id, text)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DBHelper(filename="test.db")
+        self.db.setup()
+        sql = "INSERT INTO User VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        for id in (1, 2, 3):
+            self.db.cur.execute(
+                sql, (id, 0, 0, "A", None, str(id), "en", 1, 1, 1, None, id * 10)
+            )
+        self.db.conn.commit()
+
+    def tearDown(self):
+        self.db.destroy()
+
+    def outbox(self, client, **kwargs):
+        return Outbox(self.db, client, global_rate=1000, per_chat_rate=1000, **kwargs)
+
+    def statuses(self):
+        return self.db.cur.execute(
+            "SELECT chat_id, status, attempts FROM Outbox ORDER BY id"
+        ).fetchall()
+
+    def test_broadcast_resumes_after_restart(self):
+        crashed = self.outbox(FakeClient())
+        self.assertEqual(crashed.broadcast(["one", "two"]), 1)
+        self.db.record_deliveries(sent=[1, 4])  # chat 10 got both before the crash
+        client = FakeClient()
+        outbox = self.outbox(client)
+        wait(outbox.deliver_due())
+        self.assertEqual(  # in order per chat
+            sorted(client.sent, key=lambda sent: sent[0]),
+            [(20, "one"), (20, "two"), (30, "one"), (30, "two")],
+        )
+        self.assertEqual({status for _, status, _ in self.statuses()}, {"sent"})
+        self.assertEqual(
+            outbox.progress(1), {"pending": 0, "sent": 6, "failed": 0, "total": 6}
+        )
+        outbox.stop()
+        crashed.stop()
+
+    def test_broadcast_to_chosen_chats(self):
+        client = FakeClient()
+        outbox = self.outbox(client)
+        broadcast = outbox.broadcast(["one", "two"], chat_ids=[30, 99])
+        wait(outbox.deliver_due())
+        self.assertEqual(
+            sorted(client.sent), [(30, "one"), (30, "two"), (99, "one"), (99, "two")]
+        )
+        self.assertEqual(
+            outbox.progress(broadcast),
+            {"pending": 0, "sent": 4, "failed": 0, "total": 4},
+        )
+        outbox.stop()
+
+    def test_replies_go_before_broadcasts(self):
+        client = FakeClient()
+        outbox = self.outbox(client, workers=1)
+        outbox.broadcast("news")
+        outbox.send(99, "reply")
+        wait(outbox.deliver_due())
+        self.assertEqual(client.sent, [(99, "reply")])
+        for _ in range(3):
+            wait(outbox.deliver_due())
+        self.assertEqual(
+            client.sent, [(99, "reply"), (10, "news"), (20, "news"), (30, "news")]
+        )
+        outbox.stop()
+
+    def test_retries_with_backoff(self):
+        client = FlakyClient({"ok": False, "error_code": 502})
+        outbox = self.outbox(client, base_delay=30)
+        outbox.send(10, "one")
+        outbox.send(10, "two")
+        now = time.time()
+        wait(outbox.deliver_due(now))
+        self.assertEqual(client.sent, [])  # "two" waits for "one" to be retried
+        self.assertEqual(self.db.due_messages(now + 29), [])
+        wait(outbox.deliver_due(now + 31))
+        self.assertEqual(client.sent, [(10, "one"), (10, "two")])
+        client.errors.append({"ok": False, "error_code": 403})
+        outbox.send(20, "blocked")  # not retried
+        wait(outbox.deliver_due(now + 31))
+        self.assertEqual(self.db.due_messages(now + 3600), [])
+        self.assertEqual(
+            self.statuses(), [(10, "sent", 2), (10, "sent", 1), (20, "failed", 1)]
+        )
+        outbox.stop()
+
+    def test_long_messages_are_split(self):
+        text = "line one\n" + "x" * 10
+        self.assertEqual(split_message(text, limit=12), ["line one", "x" * 10])
+        self.assertEqual(
+            split_message("x" * 25, limit=10), ["x" * 10, "x" * 10, "x" * 5]
+        )
+        self.assertEqual(split_message("a b c", limit=3), ["a b", "c"])
+        outbox = self.outbox(FakeClient())
+        outbox.send(10, "y" * 5000)
+        self.assertEqual(
+            [len(row[2]) for row in self.db.due_messages(time.time() + 1)], [4096, 904]
+        )
+        outbox.stop()
+
+
+class OcrQueueTest(unittest.TestCase):
+    IMAGES = {"a.png": b"cat", "b.png": b"cat", "c.png": b"dog"}
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.ocr_calls = []
+
+    def ocr(self, url, deadline, content=None):
+        self.ocr_calls.append((url, content))
+        self.release.wait(5)
+        if content is None:  # ocr.space fetches the URL itself
+            if url != "internal.png":
+                raise ValueError("can't fetch")
+            content = b"map"
+        return f"text of {content.decode()}"
+
+    def download(self, url, deadline):
+        if url not in self.IMAGES:
+            raise ValueError("not found")
+        return self.IMAGES[url]
+
+    def test_answers_later_dedups_and_caches(self):
+        jobs = OcrQueue(self.ocr, self.download, lambda err: "invalid URL")
+        replies = []
+        self.assertEqual(jobs.submit("a.png", replies.append), PROCESSING)
+        self.assertEqual(jobs.submit(" a.png", replies.append), PROCESSING)  # joins
+        self.release.set()
+        time.sleep(0.1)
+        self.assertEqual(replies, ["text of cat", "text of cat"])
+        self.assertEqual(jobs.submit("a.png", replies.append), DONE)  # by URL
+        self.assertEqual(jobs.extract("b.png"), "text of cat")  # same content
+        self.assertEqual(self.ocr_calls, [("a.png", b"cat")])  # uploaded
+        self.assertEqual(jobs.extract("internal.png"), "text of map")  # by URL only
+        self.assertEqual(jobs.submit("missing.png", replies.append), PROCESSING)
+        jobs.shutdown()
+        self.assertEqual(replies[-1], "invalid URL")
+        self.assertIsNone(jobs.by_url.get("missing.png"))  # errors aren't cached
+
+    def test_queues_jobs_beyond_the_workers(self):
+        jobs = OcrQueue(
+            self.ocr, self.download, lambda err: "invalid URL", workers=1, queue_size=1
+        )
+        replies = []
+        for url in ("a.png", "c.png"):
+            self.assertEqual(jobs.submit(url, replies.append), PROCESSING)
+        self.assertEqual(jobs.submit("internal.png", replies.append), BUSY)
+        self.release.set()
+        jobs.shutdown()
+        self.assertEqual(replies, ["text of cat", "text of dog"])
+
+    def test_downloads_public_urls_only(self):
+        for url in (
+            "file:///etc/passwd",
+            "http://127.0.0.1/a.png",
+            "http://localhost:8080/a.png",
+            "http://10.0.0.5/a.png",
+            "http://169.254.169.254/latest/meta-data/",
+            "http://[::ffff:127.0.0.1]/a.png",
+        ):
+            self.assertRaises(ValueError, check_public_url, url)
+        check_public_url("https://8.8.8.8/a.png")
+
+
+class FakeTwitter:
+    """Posts statuses, answering with the given errors first"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.posted = []
+
+    def update_status(self, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.posted.append(text)
+        return mock.Mock(_json={"id_str": str(len(self.posted))})
+
+
+class TweetQueueTest(unittest.TestCase):
+    def test_connects_once_and_rejects_duplicates_locally(self):
+        api = FakeTwitter()
+        connect = mock.Mock(return_value=api)
+        tweets = TweetQueue(connect, CircuitBreaker("test-twitter"), rate=1000)
+        first = tweets.post("Hello  world")
+        with self.assertRaises(DuplicateTweet):
+            tweets.post("hello world")  # still queued
+        self.assertTrue(first.result(1).endswith("/status/1"))
+        self.assertTrue(tweets.post("bye").result(1).endswith("/status/2"))
+        self.assertEqual(api.posted, ["Hello  world", "bye"])
+        self.assertEqual(connect.call_count, 1)
+        tweets.stop()
+
+    def test_waits_for_rate_limit_reset(self):
+        limited = TweepError("rate limited")
+        limited.response = mock.Mock(
+            status_code=429, headers={"x-rate-limit-reset": str(time.time())}
+        )
+        api = FakeTwitter(limited)
+        tweets = TweetQueue(lambda: api, CircuitBreaker("test-twitter"), rate=1000)
+        self.assertTrue(tweets.post("hello").result(3).endswith("/status/1"))
+        self.assertEqual(metrics.snapshot()["counters"]["twitter.rate_limited"], 1)
+        tweets.stop()
+
+    def test_missing_credentials_do_not_exit(self):
+        tweets = TweetQueue(mock.Mock(side_effect=NotConfigured("no tokens")))
+        with self.assertRaises(NotConfigured):
+            tweets.post("hello").result(1)
+        tweets.post("hello")  # failed texts may be tweeted again
+        tweets.stop()
+
+
+class CommandPoolTest(unittest.TestCase):
+    def test_rejects_when_full_and_times_out(self):
+        pool = CommandPool(
+            workers=1, queue_size=1, limit=lambda command: 2, timeout=0.2
+        )
+        release = threading.Event()
+        replies = []
+        reply = replies.append
+        self.assertTrue(pool.submit("/slow", release.wait, (), reply))
+        self.assertTrue(pool.submit("/slow", release.wait, (), reply))
+        self.assertFalse(pool.submit("/slow", release.wait, (), reply))  # limit
+        self.assertFalse(pool.submit("/other", str, (1,), reply))  # pool full
+        self.assertEqual(metrics.snapshot()["gauges"]["commands.queued"], 1)
+        time.sleep(0.4)
+        self.assertEqual(replies, [TIMEOUT_MESSAGE, TIMEOUT_MESSAGE])
+        release.set()  # late results are dropped, the slots are freed
+        time.sleep(0.1)
+        self.assertTrue(pool.submit("/other", str, (1,), reply))
+        pool.shutdown()
+        self.assertEqual(replies, [TIMEOUT_MESSAGE, TIMEOUT_MESSAGE, "1"])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_half_opens_and_closes(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.1)
+
+        def fail():
+            raise OSError("down")
+
+        for _ in range(2):
+            self.assertRaises(OSError, breaker.call, fail)
+        self.assertEqual(metrics.snapshot()["gauges"]["breaker.test.state"], "open")
+        self.assertRaises(CircuitOpen, breaker.call, str)
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())  # the half-open trial
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.call(str, 1), "1")
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_deadline(self):
+        self.assertEqual(Deadline(10).timeout()[0], 3.05)
+        self.assertLessEqual(Deadline(10).timeout()[1], 10)
+        self.assertRaises(DeadlineExceeded, Deadline(0).timeout)
+
+    def test_expired_deadlines_do_not_open_the_breaker(self):
+        for _ in range(10):
+            self.assertRaises(
+                DeadlineExceeded, api_request, "mathjs", "GET", "url", Deadline(0)
+            )
+        self.assertEqual(BREAKERS["mathjs"].state, CircuitBreaker.CLOSED)
+
+    def test_weather_fails_fast_with_a_friendly_reply(self):
+        bad = mock.Mock(status_code=401)
+        bad.json.return_value = {"Code": "Unauthorized"}
+        with mock.patch("requests.request", return_value=bad):
+            self.assertIn("not available", weather())
+        BREAKERS["accuweather"].opened_at = time.monotonic()
+        BREAKERS["accuweather"].state = CircuitBreaker.OPEN
+        with mock.patch("requests.request") as request:
+            self.assertIn("not responding", weather(Deadline(5)))
+            request.assert_not_called()
+        BREAKERS["accuweather"].success()
+
+
+class WeatherServiceTest(unittest.TestCase):
+    def test_coalesces_fetches_and_serves_stale(self):
+        calls = []
+        release = threading.Event()
+
+        def fetch(deadline):
+            calls.append(deadline)
+            release.wait(5)
+            if len(calls) > 1:
+                raise OSError("down")
+            return "sunny"
+
+        service = WeatherService(fetch, ttl=0.2, max_stale=0.6)
+        with ThreadPoolExecutor(8) as executor:
+            results = [executor.submit(service.get) for _ in range(8)]
+            time.sleep(0.1)
+            release.set()
+        self.assertEqual([result.result() for result in results], ["sunny"] * 8)
+        self.assertEqual(len(calls), 1)  # one upstream call for all
+        self.assertEqual(service.get(), "sunny")  # fresh, from memory
+        time.sleep(0.3)
+        self.assertEqual(service.get(), "sunny")  # stale, fetching failed
+        time.sleep(0.4)
+        self.assertRaises(OSError, service.get)
+
+
+class TranslationMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DBHelper(filename="test.db")
+        self.db.setup()
+        self.fetched = []
+
+    def tearDown(self):
+        self.db.destroy()
+
+    def fetch(self, texts, deadline):
+        self.fetched.append(texts)
+        return [normalize(text).upper() for text in texts]
+
+    def test_batches_misses_and_remembers(self):
+        memory = TranslationMemory(self.fetch, self.db, window=0.1)
+        with ThreadPoolExecutor(4) as executor:
+            texts = ["hello", "Hello ", "good  morning", "bye"]
+            results = list(executor.map(memory.translate, texts))
+        self.assertEqual(results, ["HELLO", "HELLO", "GOOD MORNING", "BYE"])
+        self.assertEqual(len(self.fetched), 1)  # one request for all
+        self.assertEqual(
+            sorted(map(normalize, self.fetched[0])), ["bye", "good morning", "hello"]
+        )
+        restarted = TranslationMemory(self.fetch, self.db)
+        self.assertEqual(restarted.translate("HELLO"), "HELLO")  # from the db
+        self.assertEqual(restarted.translate("hello"), "HELLO")  # from memory
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(restarted.stats()["hit_rate"], 1.0)
+
+    def test_missing_translations_are_errors(self):
+        memory = TranslationMemory(lambda texts, deadline: texts[:1], window=0.1)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(memory.translate, text) for text in ("a", "b")]
+        self.assertRaises(ValueError, futures[1].result)
+        self.assertIsNone(memory.front.get("b"))
+
+    def test_evicts_least_recently_used(self):
+        memory = TranslationMemory(self.fetch, self.db, max_entries=10, window=0)
+        for i in range(11):
+            memory.translate(f"text {i}")
+        self.assertEqual(self.db.count_translations(), 9)
+        self.assertIsNone(self.db.get_translation("text 0"))
+        self.assertEqual(self.db.get_translation("text 10"), "TEXT 10")
+
+    def test_translate_without_token_does_not_exit(self):
+        with mock.patch.dict(os.environ, {"YANDEX_TRANSLATE_TOKEN": ""}):
+            self.assertIn("not available", translate("hello"))
+
+
+class CalculatorTest(unittest.TestCase):
+    def test_evaluates_locally(self):
+        calculator = Calculator()
+        self.assertEqual(calculator.evaluate("5*5"), "25")
+        self.assertEqual(calculator.evaluate("2^10 + 5!"), "1144")
+        self.assertEqual(calculator.evaluate("sqrt(2)"), "1.4142135623731")
+        self.assertEqual(calculator.evaluate("2 inch to cm"), "5.08 cm")
+        self.assertEqual(len(calculator.compiled), 4)
+        self.assertRaises(ZeroDivisionError, calculator.evaluate, "1/0")
+
+    def test_rejects_unsafe_and_huge_expressions(self):
+        calculator = Calculator()
+        for expr in ("__import__('os')", "().__class__", "x + 1", "[1] * 9"):
+            self.assertRaises(Unsupported, calculator.evaluate, expr)
+        for expr in (
+            "9^9^9",
+            "10^1000 * 10^1000",
+            "1000!",
+            "1" * 600,
+            "round(1, -10^7)",
+        ):
+            self.assertRaises(TooComplex, calculator.evaluate, expr)
+
+    def test_calculate_falls_back_to_mathjs(self):
+        self.assertEqual(calculate("5*5"), "Result: 25")
+        answer = mock.Mock(status_code=200, text="2i")
+        with mock.patch("requests.request", return_value=answer) as request:
+            self.assertEqual(calculate("(-4)^0.5"), "Result: 2i")
+        self.assertIn("api.mathjs.org", request.call_args[0][1])
+
+
+def chat_update(update_id, chat_id):
+    return Update(update_id, MessageIn(update_id, None, chat_id, 0, "text"))
+
+
+class ChatDispatcherTest(unittest.TestCase):
+    def test_keeps_chat_order_and_runs_chats_in_parallel(self):
+        handled = []
+        lock = threading.Lock()
+
+        def handler(updates, checkpoint):
+            time.sleep(0.05)
+            with lock:
+                handled.extend(update.update_id for update in updates)
+
+        async def scenario():
+            dispatcher = ChatDispatcher(handler, ThreadPoolExecutor(4))
+            for update_id, chat_id in [(1, 10), (2, 20), (3, 10), (4, 30), (5, 10)]:
+                dispatcher.dispatch(chat_update(update_id, chat_id))
+            await dispatcher.join()
+            await dispatcher.close()
+
+        loop = asyncio.new_event_loop()
+        start = time.monotonic()
+        loop.run_until_complete(scenario())
+        loop.close()
+        self.assertLess(time.monotonic() - start, 0.25)  # 5 serial calls take 0.25s
+        self.assertEqual([i for i in handled if i in (1, 3, 5)], [1, 3, 5])
+        self.assertEqual(sorted(handled), [1, 2, 3, 4, 5])
+
+    def test_checkpoints_stop_below_updates_being_handled(self):
+        release = threading.Event()
+        checkpoints = []
+
+        def handler(updates, checkpoint):
+            if updates[0].chat_id == 10:
+                release.wait(1)
+            checkpoints.append(checkpoint(updates))
+
+        async def scenario():
+            dispatcher = ChatDispatcher(handler, ThreadPoolExecutor(2), handled=4)
+            self.assertFalse(dispatcher.dispatch(chat_update(4, 20)))  # handled
+            self.assertTrue(dispatcher.dispatch(chat_update(5, 10)))
+            self.assertTrue(dispatcher.dispatch(chat_update(6, 20)))
+            while not checkpoints:
+                await asyncio.sleep(0.01)
+            self.assertEqual(checkpoints, [4])  # 5 is still being handled
+            self.assertEqual(dispatcher.tracker.handled + 1, 5)  # the poll offset
+            self.assertFalse(dispatcher.dispatch(chat_update(6, 20)))  # polled again
+            release.set()
+            await dispatcher.join()
+            self.assertEqual(checkpoints, [4, 6])
+            self.assertEqual(dispatcher.tracker.handled, 6)
+            await dispatcher.close()
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(scenario())
+        loop.close()
+
+
+class WebhookServerTest(unittest.TestCase):
+    UPDATE = {
+        "update_id": 100,
+        "message": {
+            "message_id": 7,
+            "from": {"id": 1, "is_bot": False, "first_name": "Ahmed"},
+            "chat": {"id": 1},
+            "date": 1555512911,
+            "text": "/help",
+        },
+    }
+
+    def setUp(self):
+        self.server = WebhookServer("s3cret", host="127.0.0.1", port=0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, body, token="s3cret", path="/webhook"):
+        req = request.Request(
+            f"http://127.0.0.1:{self.server.port}{path}",
+            data=json.dumps(body).encode("utf-8"),
+            headers={SECRET_HEADER: token, "Content-Type": "application/json"},
+        )
+        try:
+            return request.urlopen(req, timeout=5).status
+        except error.HTTPError as err:
+            return err.code
+
+    def post_later(self, body):
+        """POST ``body`` on a thread, its reply waits for the update to be handled"""
+        statuses = []
+        thread = threading.Thread(target=lambda: statuses.append(self.post(body)))
+        thread.start()
+        return thread, statuses
+
+    def test_accepts_updates_with_secret(self):
+        first, statuses = self.post_later(self.UPDATE)
+        updates = self.server.get_updates(timeout=1)
+        second, later = self.post_later(dict(self.UPDATE, update_id=101))
+        updates += self.server.get_updates(timeout=1)
+        self.assertEqual([u.update_id for u in updates], [100, 101])
+        self.assertEqual(updates[0].message.text, "/help")
+        self.assertEqual(statuses, [])  # not handled yet
+        self.server.acknowledge(updates)
+        first.join()
+        second.join()
+        self.assertEqual(statuses + later, [200, 200])
+
+    def test_answers_500_to_unhandled_updates(self):
+        thread, statuses = self.post_later(self.UPDATE)
+        self.server.acknowledge(self.server.get_updates(timeout=1), handled=False)
+        thread.join()
+        self.server.reply_timeout = 0.05
+        self.assertEqual(self.post(dict(self.UPDATE, update_id=101)), 500)
+        self.assertEqual(statuses, [500])  # Telegram sends them again
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.post(self.UPDATE, token="wrong"), 403)
+        self.assertEqual(self.post(self.UPDATE, path="/other"), 404)
+        self.assertEqual(self.post({"no": "update"}), 400)
+        self.assertEqual(self.server.get_updates(timeout=0.1), [])
+
+
+class ConversationStoreTest(unittest.TestCase):
+    def test_states_are_per_user_and_chat(self):
+        store = ConversationStore()
+        store.set(1, 10, "/translate")
+        store.set(2, 10, "/calculate")
+        self.assertEqual(store.get(1, 10), "/translate")
+        self.assertEqual(store.get(2, 10), "/calculate")
+        self.assertIsNone(store.get(1, 11))
+        store.clear(1, 10)
+        self.assertIsNone(store.get(1, 10))
+
+    def test_states_expire(self):
+        store = ConversationStore(ttl=0.05)
+        store.set(1, 10, "/translate")
+        time.sleep(0.06)
+        self.assertIsNone(store.get(1, 10))
+        self.assertEqual(len(store), 0)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DBHelper(filename="test.db")
+        self.db.setup()
+
+    def tearDown(self):
+        self.db.destroy()
+
+    def test_cron_spec_next_after(self):
+        spec = CronSpec("0 8 * * 6,0,1,2,3")  # 8:00AM, Saturday to Wednesday
+        thursday = datetime(2020, 3, 5, 9, 30, tzinfo=CAIRO)
+        self.assertEqual(
+            spec.next_after(thursday), datetime(2020, 3, 7, 8, 0, tzinfo=CAIRO)
+        )
+        self.assertEqual(
+            CronSpec("*/15 * * * *").next_after(thursday),
+            datetime(2020, 3, 5, 9, 45, tzinfo=CAIRO),
+        )
+        self.assertRaises(ValueError, CronSpec, "0 24 * * *")
+
+    def test_runs_are_persisted_across_restarts(self):
+        runs = []
+        scheduler = Scheduler(self.db)
+        job = scheduler.add("tick", "* * * * *", CAIRO, lambda: runs.append(1))
+        first_run = job.next_run
+        self.assertEqual(scheduler.run_pending(first_run - 1), 0)
+        self.assertEqual(scheduler.run_pending(first_run + 150), 1)  # missed runs
+        self.assertEqual(self.db.get_state("job:tick"), first_run)
+        # restarted later: the missed run is made up once, the done one isn't repeated
+        restarted = Scheduler(self.db)
+        with mock.patch("time.time", return_value=first_run + 150):
+            job = restarted.add("tick", "* * * * *", CAIRO, lambda: runs.append(2))
+        self.assertEqual(job.next_run, first_run + 60)
+        self.assertEqual(restarted.run_pending(first_run + 150), 1)
+        self.assertEqual(runs, [1, 2])
+
+    def test_failed_runs_roll_back_and_are_retried(self):
+        runs = []
+
+        def flaky():
+            self.db.set_state("flaky", len(runs))
+            runs.append(1)
+            if len(runs) == 1:
+                raise ValueError("down")
+
+        scheduler = Scheduler(self.db, retry_delay=60)
+        job = scheduler.add("flaky", "0 8 * * *", CAIRO, flaky)
+        due = job.next_run
+        self.assertEqual(scheduler.run_pending(due), 1)
+        self.assertIsNone(self.db.get_state("job:flaky"))  # not recorded
+        self.assertIsNone(self.db.get_state("flaky"))  # its writes rolled back
+        self.assertEqual(scheduler.run_pending(due + 30), 0)
+        self.assertEqual(scheduler.run_pending(due + 60), 1)  # retried
+        self.assertEqual(self.db.get_state("job:flaky"), due)
+        self.assertEqual(self.db.get_state("flaky"), 1)
+        self.assertEqual(job.next_run, due + 24 * 3600)
+
+
+class UpdatesTest(unittest.TestCase):
+    def test_parse_updates(self):
+        body = json.dumps(
+            {
+                "ok": True,
+                "result": [
+                    WebhookServerTest.UPDATE,
+                    {"update_id": 101, "edited_message": {}},
+                ],
+            }
+        ).encode("utf-8")
+        update, edited = parse_updates(body)
+        self.assertEqual((update.update_id, update.chat_id), (100, 1))
+        self.assertEqual(update.message.sender.first_name, "Ahmed")
+        self.assertEqual(update.message.sender.language_code, "en")
+        self.assertIsNone(edited.message)
+        msg = update.message.to_message(update.update_id)
+        self.assertEqual(
+            (msg.id, msg.update_id, msg.user_id, msg.text), (7, 100, 1, "/help")
+        )
+        user = update.message.sender.to_user(update.chat_id, now=5)
+        self.assertEqual(
+            (user.id, user.chat_id, user.active, user.created), (1, 1, True, 5)
+        )
+
+
 # class CommandsTest(unittest.TestCase):
 
 #     def test_calculate_command(self):